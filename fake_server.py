@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import argparse
+import threading
+import time
+from concurrent import futures
+from concurrent.futures import Future
+import numpy as np
+import grpc
+from google.protobuf import empty_pb2
+import minecraft_pb2_grpc as mcraft_grpc
+from minecraft_pb2 import *
+import utils
+
+FAKE_WORLD_SIZE = (128, 32, 128)  # cubes along x, y and z, starting at (0, 0, 0)
+FAKE_PORT = 5001  # port of the Minecraft server
+
+
+class FakeRpcError(grpc.RpcError):
+    """
+    Error raised by the in-process stub, carrying a status code like the errors of a real channel.
+    """
+
+    def __init__(self, code, details):
+        super().__init__(details)
+        self._code = code
+        self._details = details
+
+    def code(self):
+        return self._code
+
+    def details(self):
+        return self._details
+
+
+class _InProcessContext:
+    """
+    The small part of grpc.ServicerContext used by FakeMinecraftServicer.
+    """
+
+    def abort(self, code, details):
+        raise FakeRpcError(code, details)
+
+
+class FakeMinecraftServicer(mcraft_grpc.MinecraftServiceServicer):
+    """
+    Stand-in for the Minecraft server, backed by a numpy voxel grid, such that everything runs headless.
+    The world spans FAKE_WORLD_SIZE cubes from (0, 0, 0) with BEDROCK at y=0 and AIR everywhere else; spawned blocks
+    outside of it are dropped and read as AIR. There is no physics, blocks stay where they are put.
+    Every call sleeps latency seconds, and requests touching more than the given number of voxels are rejected with
+    RESOURCE_EXHAUSTED, like the real server gets overloaded. Throughput is counted in counters.
+    """
+
+    def __init__(self, size=FAKE_WORLD_SIZE, latency=0.0, max_read_voxels=utils.READ_CUBE_MAX_VOXELS,
+                 max_fill_voxels=utils.FILL_CUBE_MAX_VOXELS, max_spawn_blocks=None):
+        self.size = tuple(size)
+        self.latency = latency
+        self.max_read_voxels = max_read_voxels
+        self.max_fill_voxels = max_fill_voxels
+        self.max_spawn_blocks = max_spawn_blocks
+        self.types = np.full(self.size, AIR, dtype=np.uint8)
+        self.types[:, 0, :] = BEDROCK
+        self.orientations = np.full(self.size, NORTH, dtype=np.uint8)
+        self._lock = threading.Lock()
+        self.counters = dict()
+        self.reset_counters()
+
+    def reset_counters(self):
+        with self._lock:
+            self.counters = {"spawnBlocks": 0, "readCube": 0, "fillCube": 0, "rejected": 0, "blocks_spawned": 0,
+                             "voxels_read": 0, "voxels_filled": 0, "busy_seconds": 0.0, "start": time.time()}
+
+    def give_throughput(self):
+        """
+        Returns calls and voxels per second since the counters were reset.
+        """
+        with self._lock:
+            seconds = max(time.time() - self.counters["start"], 1e-9)
+            return {key: value / seconds for key, value in self.counters.items()
+                    if key not in ("busy_seconds", "start")}
+
+    def _give_slices(self, min_coord, max_coord):
+        """
+        Returns the slices of the cube min_coord..max_coord clipped to the world, or None outside of it.
+        """
+        lo = [max(min_coord[i], 0) for i in range(3)]
+        hi = [min(max_coord[i], self.size[i] - 1) for i in range(3)]
+        if any(lo[i] > hi[i] for i in range(3)):
+            return None
+        return tuple(slice(lo[i], hi[i] + 1) for i in range(3))
+
+    def _book_call(self, method, voxels, limit, context):
+        """
+        Books a call of method touching voxels voxels and rejects it beyond limit.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.counters[method] += 1
+            if limit is not None and voxels > limit:
+                self.counters["rejected"] += 1
+                overloaded = True
+            else:
+                overloaded = False
+        if overloaded:
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, f"{method} of {voxels} voxels overloads the server")
+
+    def spawnBlocks(self, request, context):
+        self._book_call("spawnBlocks", len(request.blocks), self.max_spawn_blocks, context)
+        t_0 = time.time()
+        with self._lock:
+            for block in request.blocks:
+                coord = (block.position.x, block.position.y, block.position.z)
+                if all(0 <= coord[i] < self.size[i] for i in range(3)):
+                    self.types[coord] = block.type
+                    self.orientations[coord] = block.orientation
+            self.counters["blocks_spawned"] += len(request.blocks)
+            self.counters["busy_seconds"] += time.time() - t_0
+        return empty_pb2.Empty()
+
+    def readCube(self, request, context):
+        min_coord, max_coord = utils.give_min_max((request.min.x, request.min.y, request.min.z),
+                                                  (request.max.x, request.max.y, request.max.z))
+        voxels = np.prod([max_coord[i] - min_coord[i] + 1 for i in range(3)])
+        self._book_call("readCube", voxels, self.max_read_voxels, context)
+        t_0 = time.time()
+        region = np.full([max_coord[i] - min_coord[i] + 1 for i in range(3)], AIR, dtype=np.uint8)
+        with self._lock:
+            slices = self._give_slices(min_coord, max_coord)
+            if slices is not None:
+                region[tuple(slice(s.start - m, s.stop - m) for s, m in zip(slices, min_coord))] = self.types[slices]
+        coords = np.argwhere(np.ones(region.shape, dtype=bool)) + np.array(min_coord)
+        response = Blocks(blocks=[Block(position=Point(x=x, y=y, z=z), type=t)
+                                  for (x, y, z), t in zip(coords.tolist(), region.ravel().tolist())])
+        with self._lock:
+            self.counters["voxels_read"] += int(voxels)
+            self.counters["busy_seconds"] += time.time() - t_0
+        return response
+
+    def fillCube(self, request, context):
+        cube = request.cube
+        min_coord, max_coord = utils.give_min_max((cube.min.x, cube.min.y, cube.min.z),
+                                                  (cube.max.x, cube.max.y, cube.max.z))
+        voxels = np.prod([max_coord[i] - min_coord[i] + 1 for i in range(3)])
+        self._book_call("fillCube", voxels, self.max_fill_voxels, context)
+        t_0 = time.time()
+        with self._lock:
+            slices = self._give_slices(min_coord, max_coord)
+            if slices is not None:
+                self.types[slices] = request.type
+                self.orientations[slices] = NORTH
+            self.counters["voxels_filled"] += int(voxels)
+            self.counters["busy_seconds"] += time.time() - t_0
+        return empty_pb2.Empty()
+
+
+class _InProcessMethod:
+    """
+    Calls a servicer method directly, mimicking the call and future interface of a unary-unary stub method.
+    """
+
+    def __init__(self, method):
+        self._method = method
+
+    def __call__(self, request, timeout=None):
+        return self._method(request, _InProcessContext())
+
+    def future(self, request, timeout=None):
+        future = Future()
+        try:
+            future.set_result(self(request))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class InProcessStub:
+    """
+    Drop-in replacement of minecraft_pb2_grpc.MinecraftServiceStub calling a servicer within this process, without
+    any serialization or network, e.g., utils.BlockBuffer(client=InProcessStub(FakeMinecraftServicer())).
+    """
+
+    def __init__(self, servicer):
+        self.spawnBlocks = _InProcessMethod(servicer.spawnBlocks)
+        self.readCube = _InProcessMethod(servicer.readCube)
+        self.fillCube = _InProcessMethod(servicer.fillCube)
+
+
+def serve(servicer, port=0, max_workers=8):
+    """
+    Starts a gRPC server for servicer on localhost. With port=0, an ephemeral port is chosen.
+    Returns the started server and its port.
+    """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    mcraft_grpc.add_MinecraftServiceServicer_to_server(servicer, server)
+    port = server.add_insecure_port(f"localhost:{port}")
+    server.start()
+    return server, port
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Minecraft server backed by a numpy voxel grid.")
+    parser.add_argument("--port", type=int, default=FAKE_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every call takes at least")
+    parser.add_argument("--size", type=int, nargs=3, default=FAKE_WORLD_SIZE, help="cubes along x, y and z")
+    args = parser.parse_args()
+
+    fake_servicer = FakeMinecraftServicer(size=args.size, latency=args.latency)
+    fake_server, fake_port = serve(fake_servicer, port=args.port)
+    print(f"Listening on {fake_port}")
+    try:
+        fake_server.wait_for_termination()
+    except KeyboardInterrupt:
+        print(fake_servicer.counters)
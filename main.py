@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
+import json
+import os
 import random
 from minecraft_pb2 import *
 import numpy as np
+import physics
 import utils
 
 """
@@ -10,11 +13,14 @@ Constants
 """
 REQUIRED_TOTAL_RICHNESS = 3
 RICHNESS = 10
+RESOURCE_MAX_LEVEL = 255  # resource levels are stored as uint8
 REPRODUCTION_RATE = 0.7  # probability of reproduction per tick
 RECOMBINATION_RATE = 0.2  # probability of recombination per tick
 MUTATION_RATE = 0.3  # probability of mutation per tick
 NUMBER_OF_GENERATIONS = 100
 BLOCK_TYPES = [AIR, SAND, STONE, SLIME, REDSTONE_BLOCK, PISTON, STICKY_PISTON]
+BLOCK_TYPES_ARRAY = np.array(BLOCK_TYPES, dtype=np.uint8)  # block type index -> block type
+LIVING_BLOCK_TYPES = [block_type for block_type in BLOCK_TYPES if block_type != AIR]
 BLOCK_TYPES_TO_INDEX = {
     AIR: 0,
     SAND: 1,
@@ -24,6 +30,8 @@ BLOCK_TYPES_TO_INDEX = {
     PISTON: 5,
     STICKY_PISTON: 6
 }
+BLOCK_TYPES_TO_INDEX_ARRAY = np.zeros(256, dtype=np.int64)  # block type -> block type index
+BLOCK_TYPES_TO_INDEX_ARRAY[list(BLOCK_TYPES_TO_INDEX.keys())] = list(BLOCK_TYPES_TO_INDEX.values())
 BLOCK_TYPES_TO_STR = {
     AIR: "AIR",
     SAND: "SAND",
@@ -36,8 +44,30 @@ BLOCK_TYPES_TO_STR = {
 BLOCK_ORIENTATIONS = [NORTH, WEST, SOUTH, EAST, UP, DOWN]  # absolute orientations
 BLOCK_ORIENTATIONS_RELATIVE = ["up", "down", "front", "left", "back", "right"]  # relative orientations
 BAUPLAN_AXES = ["up-down", "front-back", "left-right"]  # von Neumann neighborhood axes
+BAUPLAN_AXES_TO_GENES = {
+    "up-down": (0, 1),
+    "front-back": (2, 4),
+    "left-right": (3, 5)
+}  # pairs of genome rows (indices in BLOCK_ORIENTATIONS_RELATIVE) along the axes
+BAUPLAN_AXES_PERMUTATIONS = np.array([[{gene_1: gene_2, gene_2: gene_1}.get(gene, gene) for gene in range(6)]
+                                      for gene_1, gene_2 in BAUPLAN_AXES_TO_GENES.values()])  # row swaps per axis
+DIRECTION_OFFSETS = np.array([utils.move_coordinate((0, 0, 0), direction) for direction in BLOCK_ORIENTATIONS],
+                             dtype=np.int32)  # coordinate offsets in the directions of BLOCK_ORIENTATIONS
 START_COORD = [1, 1, 1]  # start of game section
 END_COORD = [100, 10, 100]  # end of game section
+FILL_CURSOR_PATH = "fill_cube.cursor"  # persisted progress of clearing the game section
+RESOURCES_PATH = None  # prefix of the memory-mapped files of the resources, None keeps them in memory
+PISTON_REACH = 1  # a (sticky) piston displaces the blocks in front of it by a single cube
+SLIME_DRAG = 1  # blocks sticking to a moved SLIME are dragged along by a single cube
+READBACK_MARGIN = PISTON_REACH + SLIME_DRAG  # cubes read back around the bounding box of the population
+POPULATION_ENGINE = "objects"  # "objects" (Entity per block) or "arrays" (ArrayPopulation)
+SPATIAL_INDEX_CELL_SIZE = 4  # edge length of the grid cells of the spatial index
+ASYNC_FLUSH = True  # send a generation in the background while the next one is prepared
+FLUSH_MAX_RESENDS = 3  # resends of the blocks of a failed flush before the run gives up
+WORLD_BACKEND = "grpc"  # "grpc" (Minecraft server), "numpy" (in memory with physics), "null", "record" or "replay"
+SERVER_ADDRESS = "localhost:5001"  # of the Minecraft server
+RECORDING_PATH = "world.jsonl"  # recording of the world backend, written by "record" and read by "replay"
+RANDOM_SEED = None  # fixed seed to rerun the same simulation, as needed by "replay"
 BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX = {
     "up": (1, 0, 1),
     "down": (1, 2, 1),
@@ -75,16 +105,14 @@ def give_manhattan_distance(tuple_1, tuple_2):
     return round(acc)
 
 
-def give_section_dict(section):
+def give_region_blocks(region, min_coord):
     """
-    Transforms the Minecraft section response to a more useful dict with coordinate keys.
-    Leaves coords with AIR empty (no key). Unfortunately, one cannot retrieve the orientation from Minecraft.
+    Transforms a dense array of block types (as given by the shadow world) starting at min_coord to int32 coordinates
+    of shape (n, 3) and uint8 block types. Leaves out cubes with AIR, and anything else than LIVING_BLOCK_TYPES (else
+    there also emerges other stuff, like LAVA).
     """
-    section_dict = dict()
-    for cube in section:
-        if cube.type != AIR and cube.type in BLOCK_TYPES:  # else there also emerges other stuff (like LAVA)
-            section_dict[(cube.position.x, cube.position.y, cube.position.z)] = cube.type
-    return section_dict
+    local = np.argwhere(utils.give_type_mask(region, LIVING_BLOCK_TYPES))
+    return (local + np.asarray(min_coord)).astype(np.int32), region[tuple(local.T)]
 
 
 def change_cube_orientation(before_rel, reference_abs):
@@ -184,72 +212,318 @@ def change_cube_orientation(before_rel, reference_abs):
         print("Error in single cube rotations.")
 
 
-"""
-Class definitions
-"""
+def transform_bauplan(arr, orientation_abs):
+    """
+    Rotates a bauplan-shaped 3x3x3 array into the absolute orientation of an entity.
+    arr is oriented such that we are looking into the relative orientation (front) of the central block
+    The transformed array is created by rotating arr such that the axis back-front now lies in the absolute
+    orientation orientation_abs of the entity
+    I verified all orientations with a rotating cube on June 5, 2021
+    A significant drawback is, that we cannot get the absolute orientations of blocks from the Minecraft. Thus,
+    the power of this algorithm is hampered drastically.
+    :return: The transformed array with axes as in the game section of Minecraft:
+        (0) the first axis is directed along west-to-east (x)
+        (1) the second axis is directed along down-to-up (y)
+        (2) the third axis is directed along north-to-south (z)
+    """
+    # (1, 2) West-to-east axis:
+    # (1) If orientation_abs is west-to-east, nothing has to be changed.
+    if orientation_abs == EAST:
+        arr_transformed = arr
+    # (2) If orientation_abs is east-to-west, the bauplan has to be flipped twice.
+    elif orientation_abs == WEST:
+        arr_transformed = np.flip(np.flip(arr, 0), 2)
+
+    # (3, 4) Down-to-up axis:
+    # (3) If orientation_abs is down-to-up, the bauplan has to be mirrored and flipped.
+    elif orientation_abs == UP:
+        arr_transformed = np.flip(arr.swapaxes(0, 1), 1)
+    # (4) If orientation_abs is up-to-down, the bauplan has to be mirrored and flipped.
+    elif orientation_abs == DOWN:
+        arr_transformed = np.flip(arr.swapaxes(0, 1), 2)
 
+    # (5, 6) North-to-south axis:
+    # (5) If orientation_abs is north-to-south, the bauplan has to be mirrored and flipped.
+    elif orientation_abs == SOUTH:
+        arr_transformed = np.flip(arr.swapaxes(0, 2), 0)
+    # (6) If orientation_abs is south-to-north, the bauplan has to be mirrored and flipped.
+    else:  # orientation_abs == NORTH
+        arr_transformed = np.flip(arr.swapaxes(0, 2), 2)
 
-class BauplanBlock:
+    return arr_transformed
+
+
+def give_rotation_tables():
     """
-    Single block has a type and a relative orientation in a bauplan.
+    Precomputes all orientation transforms as lookup tables indexed by the absolute orientation of an entity:
+    - GENE_TABLE[orientation_abs, direction] is the genome row (the relative orientation index) whose block an
+      entity creates in the absolute direction (see BLOCK_ORIENTATIONS),
+    - ORIENTATION_TABLE[orientation_abs, orientation_relative] is the absolute orientation of such a block.
     """
+    genes = np.full((3, 3, 3), -1, dtype=np.int8)
+    for gene, direction_relative in enumerate(BLOCK_ORIENTATIONS_RELATIVE):
+        genes[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX[direction_relative]] = gene
+    gene_table = np.zeros((len(BLOCK_ORIENTATIONS), len(BLOCK_ORIENTATIONS)), dtype=np.uint8)
+    orientation_table = np.zeros((len(BLOCK_ORIENTATIONS), len(BLOCK_ORIENTATIONS_RELATIVE)), dtype=np.uint8)
+    for orientation_abs in BLOCK_ORIENTATIONS:
+        genes_transformed = transform_bauplan(genes, orientation_abs)
+        for direction in BLOCK_ORIENTATIONS:
+            gene_table[orientation_abs, direction] = genes_transformed[utils.move_coordinate((1, 1, 1), direction)]
+        for gene, direction_relative in enumerate(BLOCK_ORIENTATIONS_RELATIVE):
+            orientation_table[orientation_abs, gene] = change_cube_orientation(before_rel=direction_relative,
+                                                                               reference_abs=orientation_abs)
+    return gene_table, orientation_table
 
-    def __init__(self, block_type, orientation_relative):
-        self.block_type = block_type
-        self.orientation_relative = orientation_relative
 
-    def __repr__(self):
-        return f"{BLOCK_TYPES_TO_STR[self.block_type]}_{self.orientation_relative}"
+GENE_TABLE, ORIENTATION_TABLE = give_rotation_tables()
+
+
+def give_offspring(genomes, orientations_abs, directions):
+    """
+    Returns the block types and absolute orientations of the offspring that entities with genomes (shape (n, 6, 2)) and
+    absolute orientations create in the given absolute directions, by table lookups only.
+    """
+    rows = genomes[np.arange(len(genomes)), GENE_TABLE[orientations_abs, directions]]
+    return BLOCK_TYPES_ARRAY[rows[:, 0]], ORIENTATION_TABLE[orientations_abs, rows[:, 1]]
+
+
+def give_offspring_directions(coords, rng):
+    """
+    Draws a direction for every coord of shape (n, 3) at once, uniformly among the directions whose neighbor lies
+    within the Y bounds of the game section (the largest random key among the valid directions wins).
+    """
+    new_y = coords[:, None, 1] + DIRECTION_OFFSETS[None, :, 1]
+    keys = rng.random(new_y.shape)
+    keys[(new_y < START_COORD[1]) | (new_y > END_COORD[1])] = -1.0
+    return keys.argmax(axis=1)
+
+
+def give_voxel_winners(parent_coords, offspring_coords):
+    """
+    Returns the sorted indices of the offspring which get their voxel. When several parents target the same voxel in
+    one tick, the parent with the lexicographically lowest coord wins, the others do not reproduce.
+    """
+    order = np.lexsort((parent_coords[:, 2], parent_coords[:, 1], parent_coords[:, 0]))
+    _, first = np.unique(utils.give_coord_keys(offspring_coords[order]), return_index=True)
+    return np.sort(order[first])
+
+
+def give_hashes(keys, seed=0):
+    """
+    Returns seeded pseudo-random uint64 hashes (splitmix64) of int64 keys, which depend only on the keys and not on
+    their order.
+    """
+    with np.errstate(over="ignore"):
+        hashes = np.asarray(keys).astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return hashes ^ (hashes >> np.uint64(31))
+
+
+def give_world_backend(name: str):
+    """
+    Returns the world backend called name (see WORLD_BACKEND).
+    """
+    give_backends = {"grpc": lambda: utils.GrpcBackend(SERVER_ADDRESS),
+                     "numpy": lambda: physics.NumpyBackend(),
+                     "null": lambda: utils.NullBackend(),
+                     "record": lambda: utils.RecordingBackend(utils.GrpcBackend(SERVER_ADDRESS), RECORDING_PATH),
+                     "replay": lambda: utils.ReplayBackend(RECORDING_PATH)}
+    assert name in give_backends, f"Unknown world backend: {name}"
+    return give_backends[name]()
+
+
+def give_with_resends(give, block_buffer, max_resends=FLUSH_MAX_RESENDS):
+    """
+    Returns give(), which waits for the flush in flight (e.g., building a population or block_buffer.barrier). A
+    failed flush puts its unsent blocks back into the buffer (see utils.BlockBuffer.barrier), which are then sent
+    again and give() is retried, up to max_resends times before the run gives up.
+    """
+    for resend in range(max_resends + 1):
+        try:
+            return give()
+        except utils.FlushError as e:
+            if resend == max_resends:
+                raise
+            print(f"Flush failed ({e.__cause__!r}), resending {len(e.unsent[0])} blocks.")
+            block_buffer.send_to_server(wait=False)
+
+
+"""
+Class definitions
+"""
 
 
 class Bauplan:
     """
     Every block has a surrounding (von Neumann) neighborhood (bauplan) it tries to create.
+    The genome is stored compactly as uint8 array of shape (6, 2): for every relative direction (in the order of
+    BLOCK_ORIENTATIONS_RELATIVE) the index of the block type in BLOCK_TYPES and of its relative orientation in
+    BLOCK_ORIENTATIONS_RELATIVE.
     """
 
-    def __init__(self):
-        self.arr = np.repeat(None, 27).reshape((3, 3, 3))  # any bauplan is oriented such that they you are looking
-        # through the tensor (eyes are outwards of 3rd slice)
-        for direction in BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX.keys():
-            self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX[direction]] = BauplanBlock(
-                block_type=AIR if random.random() < 0.5 else random.choice(BLOCK_TYPES),
-                orientation_relative=random.choice(BLOCK_ORIENTATIONS_RELATIVE))
+    def __init__(self, genome=None):
+        if genome is None:
+            genome = np.zeros((len(BLOCK_ORIENTATIONS_RELATIVE), 2), dtype=np.uint8)
+            for gene in range(len(BLOCK_ORIENTATIONS_RELATIVE)):
+                genome[gene] = (BLOCK_TYPES.index(AIR) if random.random() < 0.5 else random.randrange(len(BLOCK_TYPES)),
+                                random.randrange(len(BLOCK_ORIENTATIONS_RELATIVE)))
+        self.genome = genome
+
+    def __repr__(self):
+        return ", ".join(f"{direction}: {BLOCK_TYPES_TO_STR[BLOCK_TYPES[type_index]]}_"
+                         f"{BLOCK_ORIENTATIONS_RELATIVE[orientation_index]}"
+                         for direction, (type_index, orientation_index) in zip(BLOCK_ORIENTATIONS_RELATIVE,
+                                                                               self.genome.tolist()))
 
     def mutate(self):
         """
         Always yields a single block change: differently oriented blocks are always "different" blocks.
         Some orientation changes will be silent mutations. This only alters the bauplan.
         """
-        rnd_neighbor = BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX[random.choice(BLOCK_ORIENTATIONS_RELATIVE)]
-        rnd_type = self.arr[rnd_neighbor].block_type
-        rnd_orientation_relative = self.arr[rnd_neighbor].orientation_relative
-        while (rnd_type, rnd_orientation_relative) == (self.arr[rnd_neighbor].block_type,
-                                                       self.arr[rnd_neighbor].orientation_relative):
-            rnd_type = random.choice(BLOCK_TYPES)
-            rnd_orientation_relative = random.choice(BLOCK_ORIENTATIONS_RELATIVE)
-        self.arr[rnd_neighbor].block_type = rnd_type
-        self.arr[rnd_neighbor].orientation_relative = rnd_orientation_relative
+        gene = random.randrange(len(BLOCK_ORIENTATIONS_RELATIVE))
+        rnd_type, rnd_orientation_relative = self.genome[gene].tolist()
+        while (rnd_type, rnd_orientation_relative) == tuple(self.genome[gene].tolist()):
+            rnd_type = random.randrange(len(BLOCK_TYPES))
+            rnd_orientation_relative = random.randrange(len(BLOCK_ORIENTATIONS_RELATIVE))
+        self.genome[gene] = (rnd_type, rnd_orientation_relative)
 
     def recombine(self):
         """
         To be more precise, this mechanism is gene conversion and not sexual recombination, within a single individual.
         """
-        rnd_axis = random.choice(BAUPLAN_AXES)
-        if rnd_axis == "up-down":
-            temp = self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["up"]]
-            self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["up"]] = \
-                self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["down"]]
-            self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["down"]] = temp
-        elif rnd_axis == "front-back":
-            temp = self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["front"]]
-            self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["front"]] = \
-                self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["back"]]
-            self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["back"]] = temp
-        else:  # rnd_axis == "left-right"
-            temp = self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["left"]]
-            self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["left"]] = \
-                self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["right"]]
-            self.arr[BLOCK_ORIENTATIONS_RELATIVE_TO_INDEX["right"]] = temp
+        gene_1, gene_2 = BAUPLAN_AXES_TO_GENES[random.choice(BAUPLAN_AXES)]
+        self.genome[[gene_1, gene_2]] = self.genome[[gene_2, gene_1]]
+
+
+class GenomeStore:
+    """
+    Registry of all genomes alive. Identical genomes are interned (hash-consed) into a single compact id, such that a
+    population sharing a few genomes stores only a few (6, 2) arrays. Genomes are never changed in place: mutation and
+    recombination are copy-on-write and hand out the id of the resulting genome. Every holder of an id owns a
+    reference, and a genome is freed once its last reference is released.
+    """
+
+    def __init__(self, capacity=1024):
+        self.genomes = np.zeros((capacity, len(BLOCK_ORIENTATIONS_RELATIVE), 2), dtype=np.uint8)
+        self.refcounts = np.zeros(capacity, dtype=np.int64)
+        self._ids = dict()  # genome bytes -> id
+        self._free_ids = list()
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def intern(self, genome):
+        """
+        Returns the id of genome, which is stored if no identical genome is known. No reference is acquired.
+        """
+        genome = np.asarray(genome, dtype=np.uint8)
+        key = genome.tobytes()
+        genome_id = self._ids.get(key)
+        if genome_id is None:
+            if self._free_ids:
+                genome_id = self._free_ids.pop()
+            else:
+                if self._next_id == len(self.genomes):  # double the capacity
+                    self.genomes = np.concatenate([self.genomes, np.zeros_like(self.genomes)])
+                    self.refcounts = np.concatenate([self.refcounts, np.zeros_like(self.refcounts)])
+                genome_id = self._next_id
+                self._next_id += 1
+            self.genomes[genome_id] = genome
+            self._ids[key] = genome_id
+        return genome_id
+
+    def give_genome(self, genome_id):
+        """
+        Returns a read-only view of the genome with genome_id.
+        """
+        genome = self.genomes[genome_id]
+        genome.flags.writeable = False
+        return genome
+
+    def acquire(self, genome_ids):
+        """
+        Acquires a reference of every id in genome_ids (a single id or an array, ids may repeat).
+        """
+        np.add.at(self.refcounts, np.asarray(genome_ids, dtype=np.int64), 1)
+
+    def release(self, genome_ids):
+        """
+        Releases a reference of every id in genome_ids (a single id or an array, ids may repeat) and frees the genomes
+        without references left.
+        """
+        genome_ids = np.asarray(genome_ids, dtype=np.int64)
+        np.subtract.at(self.refcounts, genome_ids, 1)
+        unique_ids = np.unique(genome_ids)
+        assert (self.refcounts[unique_ids] >= 0).all()
+        for genome_id in unique_ids[self.refcounts[unique_ids] == 0].tolist():
+            del self._ids[self.genomes[genome_id].tobytes()]
+            self._free_ids.append(genome_id)
+
+    def intern_many(self, genomes):
+        """
+        Returns the ids of genomes of shape (n, 6, 2), interning every distinct genome only once.
+        """
+        if len(genomes) == 0:
+            return np.zeros(0, dtype=np.int32)
+        unique_genomes, inverse = np.unique(genomes.reshape(len(genomes), -1), axis=0, return_inverse=True)
+        unique_ids = np.array([self.intern(genome.reshape(genomes.shape[1:])) for genome in unique_genomes],
+                              dtype=np.int32)
+        return unique_ids[inverse.ravel()]
+
+    def _transfer(self, genome_id, new_genome):
+        new_genome_id = self.intern(new_genome)
+        self.acquire(new_genome_id)
+        self.release(genome_id)
+        return new_genome_id
+
+    def mutate(self, genome_id):
+        """
+        Returns the id of a mutated copy of the genome with genome_id, moving the caller's reference over to it.
+        """
+        bauplan = Bauplan(genome=self.genomes[genome_id].copy())
+        bauplan.mutate()
+        return self._transfer(genome_id, bauplan.genome)
+
+    def recombine(self, genome_id):
+        """
+        Returns the id of a recombined copy of the genome with genome_id, moving the caller's reference over to it.
+        """
+        bauplan = Bauplan(genome=self.genomes[genome_id].copy())
+        bauplan.recombine()
+        return self._transfer(genome_id, bauplan.genome)
+
+    def _transfer_many(self, genome_ids, new_genomes):
+        new_genome_ids = self.intern_many(new_genomes)
+        self.acquire(new_genome_ids)
+        self.release(genome_ids)
+        return new_genome_ids
+
+    def mutate_many(self, genome_ids, rng):
+        """
+        Batched mutate for an array of genome ids: a random row of every genome is changed into a (block type,
+        orientation) pair which is guaranteed to differ, by adding a random offset in 1..41 to its pair code modulo 42.
+        Returns the new ids, moving the caller's references over to them.
+        """
+        genome_ids = np.asarray(genome_ids)
+        genomes = self.genomes[genome_ids]
+        rows = np.arange(len(genome_ids)), rng.integers(len(BLOCK_ORIENTATIONS_RELATIVE), size=len(genome_ids))
+        pairs = len(BLOCK_TYPES) * len(BLOCK_ORIENTATIONS_RELATIVE)
+        codes = genomes[rows][:, 0].astype(np.int64) * len(BLOCK_ORIENTATIONS_RELATIVE) + genomes[rows][:, 1]
+        codes = (codes + rng.integers(1, pairs, size=len(genome_ids))) % pairs
+        genomes[rows] = np.stack(np.divmod(codes, len(BLOCK_ORIENTATIONS_RELATIVE)), axis=1)
+        return self._transfer_many(genome_ids, genomes)
+
+    def recombine_many(self, genome_ids, rng):
+        """
+        Batched recombine for an array of genome ids: the rows of every genome are swapped along a random axis by an
+        index permutation. Returns the new ids, moving the caller's references over to them.
+        """
+        genome_ids = np.asarray(genome_ids)
+        permutations = BAUPLAN_AXES_PERMUTATIONS[rng.integers(len(BAUPLAN_AXES), size=len(genome_ids))]
+        genomes = self.genomes[genome_ids][np.arange(len(genome_ids))[:, None], permutations]
+        return self._transfer_many(genome_ids, genomes)
 
 
 class Entity:
@@ -259,7 +533,7 @@ class Entity:
     (i.e., the bauplan) and can mutate (consuming a resource), recombine (conversion) as well as mutate.
     - The position is given as a discrete point composed out of a positive integer 3-tuple, i.e., (x, y, z).
     - The bauplan is given as a collection of block types/orientations for all directions in the von Neumann
-    neighborhood.
+    neighborhood. It is held as the id of a genome in a GenomeStore, shared by all entities with the same bauplan.
     - The resources required for reproduction is collected from the environment (not "physically represented").
 
     Obtaining food is not simulated within the Minecraft server, as it is rather slow, but within the Python script.
@@ -273,82 +547,41 @@ class Entity:
     occurs on this smallest unit of evolution.
     """
 
-    def __init__(self, coord: (int, int, int), block_type: int, orientation_abs: str, bauplan: Bauplan, resources,
-                 block_buffer: utils.BlockBuffer):
+    def __init__(self, coord: (int, int, int), block_type: int, orientation_abs: str, genome_id: int,
+                 genome_store: GenomeStore, resources, block_buffer: utils.BlockBuffer):
         self.coord = coord
         self.block_type = block_type
         self.orientation_abs = orientation_abs  # absolute orientation
-        self.bauplan = bauplan  # bauplan in relative orientation
+        self.genome_id = genome_id  # bauplan in relative orientation
+        self.genome_store = genome_store
+        self.genome_store.acquire(genome_id)
         self.resources = resources
-        self.bauplan_transformed = self.transform_bauplan()  # bauplan in absolute orientation (only array)
         self.block_buffer = block_buffer
         self.block_buffer.add_block(coord=coord, orientation=orientation_abs, block_type=block_type)
 
     def __repr__(self):
-        return f"{self.coord}\n{self.bauplan}"
-
-    def transform_bauplan(self):
-        """
-        self.bauplan is oriented such that we are looking into the relative orientation (front) of the central block
-        self.bauplan_transformed is created by rotating self.bauplan such that the axis back-front now lies in the
-        absolute orientation of the entity, entity.orientation.abs
-        I verified all orientations with a rotating cube on June 5, 2021
-        A significant drawback is, that we cannot get the absolute orientations of blocks from the Minecraft. Thus,
-        the power of this algorithm is hampered drastically.
-        :return: The transformed bauplan (a numpy array) with axes as in the game section of Minecraft:
-            (0) the first axis is directed along west-to-east (x)
-            (1) the second axis is directed along down-to-up (y)
-            (2) the third axis is directed along north-to-south (z)
-        """
-        # (1, 2) West-to-east axis:
-        # (1) If orientation_abs is west-to-east, nothing has to be changed.
-        if self.orientation_abs == "east":
-            bauplan_transformed = self.bauplan.arr
-        # (2) If orientation_abs is east-to-west, the bauplan has to be flipped twice.
-        elif self.orientation_abs == "west":
-            bauplan_transformed = np.flip(np.flip(self.bauplan.arr, 0), 2)
-
-        # (3, 4) Down-to-up axis:
-        # (3) If orientation_abs is down-to-up, the bauplan has to be mirrored and flipped.
-        elif self.orientation_abs == "up":
-            bauplan_transformed = np.flip(self.bauplan.arr.swapaxes(0, 1), 1)
-        # (4) If orientation_abs is up-to-down, the bauplan has to be mirrored and flipped.
-        elif self.orientation_abs == "down":
-            bauplan_transformed = np.flip(self.bauplan.arr.swapaxes(0, 1), 2)
-
-        # (5, 6) North-to-south axis:
-        # (5) If orientation_abs is north-to-south, the bauplan has to be mirrored and flipped.
-        elif self.orientation_abs == "south":
-            bauplan_transformed = np.flip(self.bauplan.arr.swapaxes(0, 2), 0)
-        # (6) If orientation_abs is south-to-north, the bauplan has to be mirrored and flipped.
-        else:  # self.orientation_abs == "north"
-            bauplan_transformed = np.flip(self.bauplan.arr.swapaxes(0, 2), 2)
-
-        return bauplan_transformed
+        return f"{self.coord}\n{Bauplan(genome=self.genome_store.give_genome(self.genome_id))}"
 
     def reproduce(self):
         """
         An entity firstly decides on what to reproduce, and only succeeds if the chosen block is available.
         """
-        rnd_neighbor = random.choice(BLOCK_ORIENTATIONS)  # choose random cube for the offspring
+        # choose random cube for the offspring, bedrock at y=0 is impermeable
+        rnd_neighbor = random.choice([direction for direction in BLOCK_ORIENTATIONS
+                                      if START_COORD[1] <= self.coord[1] + DIRECTION_OFFSETS[direction, 1]
+                                      <= END_COORD[1]])
         new_coord_abs = utils.move_coordinate(self.coord, rnd_neighbor)  # gives absolute coord of cube
-        # Bedrock at y=0 is impermeable
-        while new_coord_abs[1] < START_COORD[1] or new_coord_abs[1] > END_COORD[1]:
-            rnd_neighbor = random.choice(BLOCK_ORIENTATIONS)
-            new_coord_abs = utils.move_coordinate(self.coord, rnd_neighbor)
-        new_coord_rel_trans = utils.move_coordinate((1, 1, 1), rnd_neighbor)  # gives relative coord of cube
-        new_orientation_abs = change_cube_orientation(
-            before_rel=self.bauplan_transformed[new_coord_rel_trans].orientation_relative,
-            reference_abs=self.orientation_abs)
-
-        assert self.bauplan_transformed[new_coord_rel_trans].block_type in BLOCK_TYPES
-
-        if self.resources.request_resource(coord=self.coord,
-                                           block_type=self.bauplan_transformed[new_coord_rel_trans].block_type):
+        gene = GENE_TABLE[self.orientation_abs, rnd_neighbor]  # genome row which lies in direction rnd_neighbor
+        type_index, orientation_relative = self.genome_store.give_genome(self.genome_id)[gene].tolist()
+        new_block_type = BLOCK_TYPES[type_index]
+        new_orientation_abs = int(ORIENTATION_TABLE[self.orientation_abs, orientation_relative])
+
+        if self.resources.request_resource(coord=self.coord, block_type=new_block_type):
             return Entity(coord=new_coord_abs,
-                          block_type=self.bauplan_transformed[new_coord_rel_trans].block_type,
+                          block_type=new_block_type,
                           orientation_abs=new_orientation_abs,
-                          bauplan=self.bauplan,
+                          genome_id=self.genome_id,
+                          genome_store=self.genome_store,
                           resources=self.resources,
                           block_buffer=self.block_buffer)
 
@@ -359,10 +592,113 @@ class Entity:
             return None
 
     def mutate(self):
-        self.bauplan.mutate()
+        self.genome_id = self.genome_store.mutate(self.genome_id)
 
     def recombine(self):
-        self.bauplan.recombine()
+        self.genome_id = self.genome_store.recombine(self.genome_id)
+
+    def release(self):
+        """
+        Releases the genome of a dead entity.
+        """
+        self.genome_store.release(self.genome_id)
+
+
+class SpatialIndex:
+    """
+    Uniform hash grid over coordinates for closest-coordinate queries in the Manhattan metric.
+    Queries on or right next to an indexed coordinate (the common case, as offspring are placed next to their parents)
+    are answered at once by binary search over the sorted coordinate keys. The others falling into the same grid cell
+    are answered together by searching rings of cells around it, until no unsearched cell can hold anything closer.
+    """
+
+    def __init__(self, coords, cell_size=SPATIAL_INDEX_CELL_SIZE):
+        self.coords = np.asarray(coords, dtype=np.int64).reshape((-1, 3))
+        self.cell_size = cell_size
+        self._cells = None  # grid cell -> ascending indices of the coords within, built once a query needs it
+        keys = utils.give_coord_keys(self.coords)
+        self._key_order = np.argsort(keys, kind="stable")  # the first of equal keys has the lowest index
+        self._sorted_keys = keys[self._key_order]
+
+    def _give_cells(self):
+        if self._cells is None:
+            self._cells = dict()
+            cell_coords = self.coords // self.cell_size
+            _, first, inverse = np.unique(utils.give_coord_keys(cell_coords), return_index=True, return_inverse=True)
+            cells = cell_coords[first]
+            order = np.argsort(inverse.ravel(), kind="stable")
+            bounds = np.searchsorted(inverse.ravel()[order], np.arange(len(cells) + 1))
+            for k, cell in enumerate(map(tuple, cells.tolist())):
+                self._cells[cell] = order[bounds[k]:bounds[k + 1]]
+            self._min_cell, self._max_cell = cells.min(axis=0), cells.max(axis=0)
+        return self._cells
+
+    def query(self, coords):
+        """
+        Returns for every coordinate the index of the closest indexed coordinate (ties go to the lowest index, like a
+        linear scan), or -1 if nothing is indexed.
+        """
+        queries = np.asarray(coords, dtype=np.int64).reshape((-1, 3))
+        closest = np.full(len(queries), -1, dtype=np.int64)
+        if len(self.coords) == 0 or len(queries) == 0:
+            return closest
+        closest = self._give_exact_indices(queries)
+        remaining = np.flatnonzero(closest < 0)
+        neighbors = self._give_exact_indices(queries[remaining, None, :] + DIRECTION_OFFSETS[None, :, :])
+        closest[remaining] = np.where(neighbors >= 0, neighbors, len(self.coords)).min(axis=1)
+        remaining = remaining[closest[remaining] == len(self.coords)]
+        if len(remaining) == 0:
+            return closest
+        self._give_cells()
+        cell_coords = queries[remaining] // self.cell_size
+        _, first, inverse = np.unique(utils.give_coord_keys(cell_coords), return_index=True, return_inverse=True)
+        cells = cell_coords[first]
+        order = np.argsort(inverse.ravel(), kind="stable")
+        bounds = np.searchsorted(inverse.ravel()[order], np.arange(len(cells) + 1))
+        for k, cell in enumerate(cells):
+            members = remaining[order[bounds[k]:bounds[k + 1]]]
+            closest[members] = self._query_cell(cell, queries[members])
+        return closest
+
+    def _give_exact_indices(self, coords):
+        """
+        Returns for coordinates of shape (..., 3) the lowest index of an equal indexed coordinate, or -1 if none.
+        """
+        keys = utils.give_coord_keys(coords.reshape((-1, 3))).reshape(coords.shape[:-1])
+        positions = np.minimum(np.searchsorted(self._sorted_keys, keys), len(self._sorted_keys) - 1)
+        return np.where(self._sorted_keys[positions] == keys, self._key_order[positions], -1)
+
+    def _give_ring_indices(self, cell, ring):
+        """
+        Returns the indices of all coords in grid cells at Chebyshev distance ring from cell.
+        """
+        if (2 * ring + 1) ** 3 - max(2 * ring - 1, 0) ** 3 > len(self._cells):  # cheaper to scan the occupied cells
+            return [indices for other, indices in self._cells.items()
+                    if max(abs(other[0] - cell[0]), abs(other[1] - cell[1]), abs(other[2] - cell[2])) == ring]
+        ring_indices = list()
+        for dx in range(-ring, ring + 1):
+            for dy in range(-ring, ring + 1):
+                for dz in range(-ring, ring + 1):
+                    if max(abs(dx), abs(dy), abs(dz)) == ring:
+                        indices = self._cells.get((cell[0] + dx, cell[1] + dy, cell[2] + dz))
+                        if indices is not None:
+                            ring_indices.append(indices)
+        return ring_indices
+
+    def _query_cell(self, cell, queries):
+        # After searching rings 0..ring, all unsearched coords are at least ring * cell_size + 1 away.
+        cell = tuple(int(c) for c in cell)
+        max_ring = int(np.max(np.maximum(np.abs(self._min_cell - cell), np.abs(self._max_cell - cell))))
+        candidates = list()
+        for ring in range(max_ring + 1):
+            candidates += self._give_ring_indices(cell, ring)
+            if not candidates:
+                continue
+            indices = np.sort(np.concatenate(candidates))
+            distances = np.abs(queries[:, None, :] - self.coords[indices][None, :, :]).sum(axis=2)
+            best = distances.argmin(axis=1)
+            if distances[np.arange(len(queries)), best].max() <= ring * self.cell_size or ring == max_ring:
+                return indices[best]
 
 
 class Population:
@@ -373,34 +709,54 @@ class Population:
     def __init__(self, prev_population, resources, block_buffer: utils.BlockBuffer):
         self.resources = resources
         self.block_buffer = block_buffer
+        self._spatial_index = None
         if isinstance(prev_population, Population):
             self.prev_population = prev_population
-            self.population = self.give_current_population()
+            self.genome_store = prev_population.genome_store
+            self._set_population(self.give_current_population())
+            self.prev_population.release()
+            self.prev_population = None  # do not keep all former generations alive
         elif isinstance(prev_population, Entity):  # root
-            self.prev_population = [prev_population]
-            self.population = [prev_population]
+            self.prev_population = None
+            self.genome_store = prev_population.genome_store
+            self._set_population(self.give_root_population(prev_population))
+
+    def _set_population(self, population):
+        self.population = population
+
+    def give_root_population(self, entity):
+        """
+        Returns the first population, made of the single entity (which hands over its genome reference).
+        """
+        return [entity]
 
     def give_current_population(self):
         """
         Create the current population by reproduction and associating genetics from the previous population, as well as
         mutation/recombination.
         """
-        # Associate each block with a parent and pass the corresponding bauplan to the offspring
-        game_section = self.block_buffer.get_cube_info(START_COORD, END_COORD)  # ca. 100ms
-        section_dict = give_section_dict(game_section)
+        # Associate each block with a parent and pass the corresponding genome to the offspring
+        self.prev_population.give_spatial_index()  # built while the previous generation is still being sent
+        section_coords, section_types = self.read_game_section()
+        closest_entities = self.prev_population.give_closest_entities(section_coords)
 
+        alive = self.resources.give_resource_levels(section_coords) > REQUIRED_TOTAL_RICHNESS
         population = list()
-        for coord in section_dict.keys():
-            closest_entity = self.prev_population.give_closest_entity(coord)
-            if self.resources.give_resource_level(coord) > 3:
+        culled_coords = list()
+        for coord, block_type, closest_entity, is_alive in zip(map(tuple, section_coords.tolist()),
+                                                               section_types.tolist(), closest_entities,
+                                                               alive.tolist()):
+            if is_alive:
                 population.append(Entity(coord=coord,
-                                         block_type=section_dict[coord],
+                                         block_type=block_type,
                                          orientation_abs=closest_entity.orientation_abs,
-                                         bauplan=closest_entity.bauplan,
+                                         genome_id=closest_entity.genome_id,
+                                         genome_store=self.genome_store,
                                          resources=self.resources,
                                          block_buffer=self.block_buffer))
             else:
-                block_buffer.add_block(coord=coord, orientation=NORTH, block_type=AIR)
+                culled_coords.append(coord)
+        self.block_buffer.add_blocks(coords=culled_coords, orientations=NORTH, block_types=AIR)
 
         # Apply recombination, mutation and reproduction operators.
         offspring = list()
@@ -422,51 +778,395 @@ class Population:
         population += offspring
         return population
 
+    def read_game_section(self):
+        """
+        Gives the blocks where life is, i.e., within the bounding box of the previous population widened by
+        READBACK_MARGIN. They are looked up in the shadow world of the block buffer, where SAND is settled locally and
+        which is reconciled with the world only where physics may have moved blocks otherwise. Whenever blocks show up
+        at a border of this region (which is not a border of the game section), something moved further than expected
+        and the region is widened there.
+        """
+        bounding_box = self.prev_population.give_bounding_box(margin=READBACK_MARGIN)
+        self.block_buffer.barrier()  # from here on, the previous generation has to be in the world
+        if bounding_box is None:
+            return np.zeros((0, 3), dtype=np.int32), np.zeros(0, dtype=np.uint8)
+        min_coord, max_coord = bounding_box
+        shadow_world = self.block_buffer.shadow_world
+        while True:
+            self.block_buffer.settle_sand(min_coord, max_coord)
+            self.block_buffer.reconcile_physics(min_coord, max_coord)
+            coords, types = give_region_blocks(shadow_world.give_types(min_coord, max_coord), min_coord)
+            if len(coords) == 0:
+                return coords, types
+            widened_min_coord = [max(START_COORD[i], min_coord[i] - READBACK_MARGIN)
+                                 if coords[:, i].min() == min_coord[i] else min_coord[i] for i in range(3)]
+            widened_max_coord = [min(END_COORD[i], max_coord[i] + READBACK_MARGIN)
+                                 if coords[:, i].max() == max_coord[i] else max_coord[i] for i in range(3)]
+            if (widened_min_coord, widened_max_coord) == (min_coord, max_coord):
+                return coords, types
+            min_coord, max_coord = widened_min_coord, widened_max_coord
+
+    def release(self):
+        """
+        Releases the genomes of all entities, once the population is succeeded by the next generation.
+        """
+        self.genome_store.release(self.give_genome_ids())
+
+    def give_bounding_box(self, margin=0):
+        """
+        Returns the axis-aligned bounding box (min_coord, max_coord) of all entities, widened by margin and clipped to
+        the game section, or None without any entities. Downwards, the box always reaches the floor of the game section
+        as SAND may fall arbitrarily far.
+        """
+        coords = self.give_coords()
+        if len(coords) == 0:
+            return None
+        min_coord = [max(START_COORD[i], coords[:, i].min() - margin) for i in range(3)]
+        max_coord = [min(END_COORD[i], coords[:, i].max() + margin) for i in range(3)]
+        min_coord[1] = START_COORD[1]
+        return [int(c) for c in min_coord], [int(c) for c in max_coord]
+
+    def give_spatial_index(self):
+        """
+        Returns the spatial index over the coords of all entities, built once per generation.
+        """
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.give_coords())
+        return self._spatial_index
+
+    def give_coords(self):
+        """
+        Returns the coords of all entities as an array of shape (n, 3).
+        """
+        return np.array([entity.coord for entity in self.population], dtype=np.int32).reshape((-1, 3))
+
+    def give_genome_ids(self):
+        """
+        Returns the genome ids of all entities as an array of shape (n,).
+        """
+        return np.array([entity.genome_id for entity in self.population], dtype=np.int32)
+
+    def give_closest_entities(self, coords):
+        """
+        Returns the closest entity (Manhattan distance) for every coordinate in coords of shape (n, 3).
+        """
+        return [self.population[i] if i >= 0 else None for i in self.give_spatial_index().query(coords).tolist()]
+
     def give_closest_entity(self, coord):
-        min_dist = 1_000_000
-        min_entity = None
-        for entity in self.population:
-            new_dist = give_manhattan_distance(entity.coord, coord)
-            if new_dist < min_dist:
-                min_dist = new_dist
-                min_entity = entity
-        return min_entity
+        return self.give_closest_entities([coord])[0]
+
+
+class ArrayPopulation(Population):
+    """
+    The population of entities alive, as parallel arrays instead of Entity objects (struct of arrays):
+    coords int32[n, 3], block types uint8[n], absolute orientations uint8[n] and genome ids int32[n] of the
+    GenomeStore shared by all generations. Culling, reproduction, mutation and recombination run on whole arrays.
+    """
+
+    def __init__(self, prev_population, resources, block_buffer: utils.BlockBuffer, rng=None):
+        if rng is not None:
+            self.rng = rng
+        elif isinstance(prev_population, ArrayPopulation):
+            self.rng = prev_population.rng
+        else:
+            self.rng = np.random.default_rng()
+        super().__init__(prev_population, resources, block_buffer)
+
+    def _set_population(self, population):
+        self.coords, self.block_types, self.orientations, self.genome_ids = population
+
+    def give_root_population(self, entity):
+        return (np.array([entity.coord], dtype=np.int32), np.array([entity.block_type], dtype=np.uint8),
+                np.array([entity.orientation_abs], dtype=np.uint8), np.array([entity.genome_id], dtype=np.int32))
+
+    def give_coords(self):
+        return self.coords
+
+    def give_genome_ids(self):
+        return self.genome_ids
+
+    def give_closest_entities(self, coords):
+        """
+        Returns the index of the closest entity (Manhattan distance) for every coordinate in coords of shape (n, 3), or
+        -1 if there is none.
+        """
+        return self.give_spatial_index().query(coords)
+
+    def reproduce(self, coords, orientations, genome_ids):
+        """
+        Batched reproduction of the entities with coords, orientations and genome ids: directions for all reproducing
+        entities are drawn at once, conflicts for the same voxel are resolved by give_voxel_winners and the resources
+        are requested in bulk. Returns the indices of the parents, which succeeded, and their offspring coords, block
+        types and orientations.
+        """
+        reproducing = np.flatnonzero(self.rng.random(len(coords)) > REPRODUCTION_RATE)
+        directions = give_offspring_directions(coords[reproducing], self.rng)
+        offspring_coords = coords[reproducing] + DIRECTION_OFFSETS[directions]
+        winners = give_voxel_winners(coords[reproducing], offspring_coords)
+        reproducing, directions, offspring_coords = reproducing[winners], directions[winners], offspring_coords[winners]
+        offspring_types, offspring_orientations = give_offspring(self.genome_store.genomes[genome_ids[reproducing]],
+                                                                 orientations[reproducing], directions)
+        granted = self.resources.request_resources(coords[reproducing], offspring_types,
+                                                   requesters=offspring_coords,
+                                                   seed=int(self.rng.integers(np.iinfo(np.int64).max)))
+        return reproducing[granted], offspring_coords[granted], offspring_types[granted], \
+            offspring_orientations[granted]
+
+    def give_current_population(self):
+        """
+        Array version of Population.give_current_population, returning the coords, block types, orientations and
+        genome ids of the current population.
+        """
+        self.prev_population.give_spatial_index()  # built while the previous generation is still being sent
+        section_coords, section_types = self.read_game_section()
+        parents = self.prev_population.give_closest_entities(section_coords)
+
+        # Cull entities without enough resources, the others inherit from their closest parent
+        alive = self.resources.give_resource_levels(section_coords) > REQUIRED_TOTAL_RICHNESS
+        self.block_buffer.add_blocks(coords=section_coords[~alive], orientations=NORTH, block_types=AIR)
+        coords, block_types, parents = section_coords[alive], section_types[alive], parents[alive]
+        orientations = self.prev_population.orientations[parents]
+        genome_ids = self.prev_population.genome_ids[parents]
+        self.block_buffer.add_blocks(coords=coords, orientations=orientations, block_types=block_types)
+
+        # Reproduction of all entities at once
+        parents, offspring_coords, offspring_types, offspring_orientations = \
+            self.reproduce(coords, orientations, genome_ids)
+        self.block_buffer.add_blocks(coords=offspring_coords, orientations=offspring_orientations,
+                                     block_types=offspring_types)
+
+        # Offspring inherit the genomes of their parents before mutation and recombination events of the parents
+        genome_ids = np.concatenate([genome_ids, genome_ids[parents]]).astype(np.int32)
+        self.genome_store.acquire(genome_ids)
+        mutating = parents[self.rng.random(len(parents)) > MUTATION_RATE]
+        genome_ids[mutating] = self.genome_store.mutate_many(genome_ids[mutating], self.rng)
+        recombining = parents[self.rng.random(len(parents)) > RECOMBINATION_RATE]
+        genome_ids[recombining] = self.genome_store.recombine_many(genome_ids[recombining], self.rng)
+        print(f"{len(parents)} new entities were added.")
+
+        return np.concatenate([coords, offspring_coords]).astype(np.int32), \
+            np.concatenate([block_types, offspring_types]).astype(np.uint8), \
+            np.concatenate([orientations, offspring_orientations]).astype(np.uint8), \
+            genome_ids
 
 
 class Resources:
     """
     A 3D-map keeps track of the exhausting resources (block types) at each cube position.
+    It is stored sparsely in chunks of CHUNK_SIZE x (height of the game section) x CHUNK_SIZE cubes, relative to
+    start_coord, which are allocated as uint8 when first harvested. Untouched chunks are implicitly at self.level for
+    all resources, so memory scales with the explored volume instead of the game section. Levels saturate at
+    RESOURCE_MAX_LEVEL.
+    Regrowth is lazy: grow and reset only advance the counters self.grown and self.epoch, and every chunk catches up
+    with the growth since its stamp (or is refilled after a reset) when it is accessed next.
+    Next to the levels, every chunk keeps the total level of each cube as uint16, which is updated along with them.
+    With a path, the chunks live in memory-mapped files instead (path + ".levels", ".totals" and ".stamps", one slot
+    per chunk of the game section, plus the header path + ".json"), such that the OS pages cold regions out and an
+    existing field is reopened as it was, ignoring richness.
     """
 
-    def __init__(self, start_coord: (int, int, int), end_coord: (int, int, int), richness=5):
+    def __init__(self, start_coord: (int, int, int), end_coord: (int, int, int), richness=5, path=None):
         self.start_coord = start_coord
         self.end_coord = end_coord
-        self.richness = richness
         self.x_len = end_coord[0] - start_coord[0] + 1
         self.y_len = end_coord[1] - start_coord[1] + 1
         self.z_len = end_coord[2] - start_coord[2] + 1
         self.block_types_len = len(BLOCK_TYPES)
+        self.chunk_shape = (utils.CHUNK_SIZE, self.y_len, utils.CHUNK_SIZE, self.block_types_len)
+        assert 0 <= richness <= RESOURCE_MAX_LEVEL
+        self.richness = richness
+        self.grown = 0  # growth since the last reset
+        self.epoch = 0  # number of resets
+        self._chunks = dict()  # (chunk x, chunk z) -> resource levels of the chunk
+        self._totals = dict()  # (chunk x, chunk z) -> total resource levels of the cubes of the chunk
+        self._stamps = dict()  # (chunk x, chunk z) -> (epoch, growth) the chunk is up to date with
+        self.path = path
+        if path is not None:
+            self._open_files()
 
-        # Construct the actual array
-        self.arr = np.repeat(richness, self.x_len * self.y_len * self.z_len * self.block_types_len).reshape(
-            (self.x_len, self.y_len, self.z_len, self.block_types_len))
+    def _open_files(self):
+        self.chunks_x = -(-self.x_len // utils.CHUNK_SIZE)
+        self.chunks_z = -(-self.z_len // utils.CHUNK_SIZE)
+        chunks = self.chunks_x * self.chunks_z
+        if os.path.exists(self.path + ".json"):
+            with open(self.path + ".json") as f:
+                header = json.load(f)
+            assert header["chunk_shape"] == list(self.chunk_shape) and header["chunks"] == chunks, \
+                f"{self.path} holds the resources of another game section"
+            self.richness, self.grown, self.epoch = header["richness"], header["grown"], header["epoch"]
+            mode = "r+"
+        else:
+            mode = "w+"  # the files are sparse, untouched chunks take no disk space
+        self._levels_file = np.memmap(self.path + ".levels", dtype=np.uint8, mode=mode,
+                                      shape=(chunks,) + self.chunk_shape)
+        self._totals_file = np.memmap(self.path + ".totals", dtype=np.uint16, mode=mode,
+                                      shape=(chunks,) + self.chunk_shape[:3])
+        self._stamps_file = np.memmap(self.path + ".stamps", dtype=np.int64, mode=mode, shape=(chunks, 2))
+        if mode == "w+":
+            self._stamps_file[:, 0] = -1  # never accessed
+            self._write_header()
+
+    def _write_header(self):
+        """
+        Atomically persists the counters of the memory-mapped resources.
+        """
+        with open(self.path + ".json.tmp", "w") as f:
+            json.dump({"chunk_shape": list(self.chunk_shape), "chunks": self.chunks_x * self.chunks_z,
+                       "richness": self.richness, "grown": self.grown, "epoch": self.epoch}, f)
+        os.replace(self.path + ".json.tmp", self.path + ".json")
+
+    def _give_slot(self, key):
+        assert 0 <= key[0] < self.chunks_x and 0 <= key[1] < self.chunks_z, f"Chunk outside of the game section: {key}"
+        return key[0] * self.chunks_z + key[1]
+
+    def _allocate_chunk(self, key):
+        """
+        Returns the storage of the levels, total levels and stamp of chunk key, which is refilled upon first access.
+        """
+        if self.path is None:
+            return np.empty(self.chunk_shape, dtype=np.uint8), np.empty(self.chunk_shape[:3], dtype=np.uint16), \
+                np.array([-1, 0], dtype=np.int64)
+        slot = self._give_slot(key)
+        return self._levels_file[slot], self._totals_file[slot], self._stamps_file[slot]
+
+    def _is_stored(self, key):
+        return self.path is not None and self._stamps_file[self._give_slot(key), 0] >= 0
+
+    def flush(self):
+        """
+        Writes the memory-mapped resources to disk.
+        """
+        if self.path is not None:
+            self._levels_file.flush()
+            self._totals_file.flush()
+            self._stamps_file.flush()
+            self._write_header()
+
+    def _give_chunk(self, key, allocate=True):
+        """
+        Returns the up-to-date resource levels and total levels of chunk key. Without allocate, a chunk that was not
+        allocated yet is returned as temporary read-only views of the implicit level.
+        """
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            if not allocate and not self._is_stored(key):
+                return np.broadcast_to(np.uint8(self.level), self.chunk_shape), \
+                    np.broadcast_to(np.uint16(self.level * self.block_types_len), self.chunk_shape[:3])
+            chunk, self._totals[key], self._stamps[key] = self._allocate_chunk(key)
+            self._chunks[key] = chunk
+        totals, stamp = self._totals[key], self._stamps[key]
+        epoch, grown = stamp.tolist()
+        if epoch != self.epoch:  # first access or reset since the last access
+            chunk.fill(self.level)
+            totals.fill(self.level * self.block_types_len)
+        elif grown != self.grown:
+            by = min(self.grown - grown, RESOURCE_MAX_LEVEL)
+            np.minimum(chunk, RESOURCE_MAX_LEVEL - by, out=chunk)
+            chunk += by
+            chunk.sum(axis=3, dtype=np.uint16, out=totals)
+        stamp[:] = (self.epoch, self.grown)
+        return chunk, totals
+
+    def _give_cell(self, coord: (int, int, int)):
+        x, y, z = (coord[i] - self.start_coord[i] for i in range(3))
+        assert 0 <= y < self.y_len, f"Coordinate outside of the game section: {coord}"
+        return (x // utils.CHUNK_SIZE, z // utils.CHUNK_SIZE), (x % utils.CHUNK_SIZE, y, z % utils.CHUNK_SIZE)
+
+    def _give_chunk_groups(self, coords):
+        """
+        Groups coords of shape (n, 3) by chunk. Returns the chunk keys, the indices of coords within each of them, and
+        the local cell indices of all coords.
+        """
+        coords = np.asarray(coords, dtype=np.int64).reshape(-1, 3) - np.asarray(self.start_coord)
+        assert len(coords) == 0 or (coords[:, 1].min() >= 0 and coords[:, 1].max() < self.y_len), \
+            "Coordinate outside of the game section"
+        local = (coords[:, 0] % utils.CHUNK_SIZE, coords[:, 1], coords[:, 2] % utils.CHUNK_SIZE)
+        unique_keys, inverse = np.unique(coords[:, [0, 2]] // utils.CHUNK_SIZE, axis=0, return_inverse=True)
+        order = np.argsort(inverse.ravel(), kind="stable")
+        bounds = np.searchsorted(inverse.ravel()[order], np.arange(len(unique_keys) + 1))
+        groups = [order[bounds[k]:bounds[k + 1]] for k in range(len(unique_keys))]
+        return list(map(tuple, unique_keys.tolist())), groups, local
 
     def request_resource(self, coord: (int, int, int), block_type: int):
-        if self.arr[coord[0] - 1, coord[1] - 1, coord[2] - 1, BLOCK_TYPES_TO_INDEX[block_type]] > 0:
-            self.arr[coord[0] - 1, coord[1] - 1, coord[2] - 1, BLOCK_TYPES_TO_INDEX[block_type]] -= 1
+        key, local = self._give_cell(coord)
+        cell = local + (BLOCK_TYPES_TO_INDEX[block_type],)
+        if self._give_chunk(key, allocate=False)[0][cell] > 0:
+            chunk, totals = self._give_chunk(key)
+            chunk[cell] -= 1
+            totals[local] -= 1
             return True
         else:
             return False
 
+    def request_resources(self, coords, block_types, requesters=None, seed=0):
+        """
+        Bulk version of request_resource for the demands of a whole generation, given as coords of shape (n, 3) and
+        block types of shape (n,). Returns the mask of granted requests.
+        Requests are grouped by resource (coord and block type) and granted up to its level. Contested resources go to
+        the requests with the lowest seeded hashes of their requesters (coords of shape (n, 3), by default coords), so
+        the outcome does not depend on the order of the requests. Levels are decremented by one scatter per chunk.
+        """
+        keys, groups, local = self._give_chunk_groups(coords)
+        type_indices = BLOCK_TYPES_TO_INDEX_ARRAY[np.asarray(block_types, dtype=np.int64).reshape(-1)]
+        cell_indices = np.ravel_multi_index(local + (type_indices,), self.chunk_shape)
+        chunk_indices = np.zeros(len(cell_indices), dtype=np.int64)
+        available = np.zeros(len(cell_indices), dtype=np.int64)
+        for k, (key, indices) in enumerate(zip(keys, groups)):
+            chunk_indices[indices] = k
+            available[indices] = self._give_chunk(key, allocate=False)[0].reshape(-1)[cell_indices[indices]]
+        cells = chunk_indices * np.prod(self.chunk_shape) + cell_indices
+        requesters = coords if requesters is None else requesters
+        priorities = give_hashes(utils.give_coord_keys(np.asarray(requesters).reshape(-1, 3)) * len(BLOCK_TYPES)
+                                 + type_indices, seed)
+        order = np.lexsort((priorities, cells))
+        sorted_cells = cells[order]
+        starts = np.flatnonzero(np.concatenate([[True], sorted_cells[1:] != sorted_cells[:-1]]))
+        ranks = np.arange(len(cells)) - np.repeat(starts, np.diff(np.append(starts, len(cells))))
+        granted = np.zeros(len(cells), dtype=bool)
+        granted[order] = ranks < available[order]
+        for key, indices in zip(keys, groups):
+            indices = indices[granted[indices]]
+            if len(indices):
+                chunk, totals = self._give_chunk(key)
+                unique_cells, counts = np.unique(cell_indices[indices], return_counts=True)
+                chunk.reshape(-1)[unique_cells] -= counts.astype(np.uint8)
+                np.subtract.at(totals.reshape(-1), unique_cells // self.block_types_len, counts.astype(np.uint16))
+        return granted
+
     def give_resource_level(self, coord: (int, int, int)):
-        return sum(self.arr[coord[0] - 1, coord[1] - 1, coord[2] - 1])
+        key, local = self._give_cell(coord)
+        return int(self._give_chunk(key, allocate=False)[1][local])
+
+    def give_resource_levels(self, coords):
+        """
+        Batched give_resource_level for coords of shape (n, 3), gathering the totals chunk by chunk.
+        """
+        keys, groups, local = self._give_chunk_groups(coords)
+        levels = np.zeros(len(local[0]), dtype=np.int64)
+        for key, indices in zip(keys, groups):
+            levels[indices] = self._give_chunk(key, allocate=False)[1][tuple(axis[indices] for axis in local)]
+        return levels
+
+    @property
+    def level(self):
+        """
+        Level of all resources in untouched chunks.
+        """
+        return min(self.richness + self.grown, RESOURCE_MAX_LEVEL)
 
     def grow(self, by=1):
-        self.arr += by
+        assert by >= 0
+        self.grown += by
+        if self.path is not None:
+            self._write_header()
 
     def reset(self, richness=5):
-        self.arr = np.repeat(richness, self.x_len * self.y_len * self.z_len * self.block_types_len).reshape(
-            (self.x_len, self.y_len, self.z_len, self.block_types_len))
+        assert 0 <= richness <= RESOURCE_MAX_LEVEL
+        self.richness = richness
+        self.grown = 0
+        self.epoch += 1
+        if self.path is not None:
+            self._write_header()
 
 
 """
@@ -478,9 +1178,12 @@ if __name__ == "__main__":
     The bottom horizontal plane (x, y=0, z) contains non-permeable BEDROCK.
     Outside the game section defined by START_COORD and END_COORD are no resources.
     """
-    block_buffer = utils.BlockBuffer()
-    block_buffer.fill_cube(start_coord=START_COORD, end_coord=END_COORD, block_type=AIR)
-    resources = Resources(start_coord=START_COORD, end_coord=END_COORD, richness=RICHNESS)
+    random.seed(RANDOM_SEED)
+    block_buffer = utils.BlockBuffer(backend=give_world_backend(WORLD_BACKEND))
+    block_buffer.fill_cube(start_coord=START_COORD, end_coord=END_COORD, block_type=AIR,
+                           cursor_path=FILL_CURSOR_PATH,
+                           progress=lambda done, total: print(f"Cleared {done}/{total} tiles of the game section."))
+    resources = Resources(start_coord=START_COORD, end_coord=END_COORD, richness=RICHNESS, path=RESOURCES_PATH)
 
     """
     Seeding of the simulation with the first population containing a single entity.
@@ -489,17 +1192,21 @@ if __name__ == "__main__":
     root_coord = (int((END_COORD[0] - START_COORD[0]) / 2),
                   1,
                   int((END_COORD[2] - START_COORD[2]) / 2))
-    root_bauplan = Bauplan()
+    genome_store = GenomeStore()
     root_entity = Entity(coord=root_coord,
                          block_type=REDSTONE_BLOCK,
                          orientation_abs=NORTH,
-                         bauplan=root_bauplan,
+                         genome_id=genome_store.intern(Bauplan().genome),
+                         genome_store=genome_store,
                          resources=resources,
                          block_buffer=block_buffer)
-    root_population = Population(prev_population=root_entity,
-                                 resources=resources,
-                                 block_buffer=block_buffer)  # first generation
-    block_buffer.send_to_server()
+    population_class = ArrayPopulation if POPULATION_ENGINE == "arrays" else Population
+    population_options = {"rng": np.random.default_rng(RANDOM_SEED)} if population_class is ArrayPopulation else {}
+    root_population = population_class(prev_population=root_entity,
+                                       resources=resources,
+                                       block_buffer=block_buffer,
+                                       **population_options)  # first generation
+    give_with_resends(lambda: block_buffer.send_to_server(wait=not ASYNC_FLUSH), block_buffer)
 
     """
     Now we simulate for NUMBER_OF_GENERATIONS generations, i.e., generation 2 until generation 1+NUMBER_OF_GENERATIONS.
@@ -507,7 +1214,9 @@ if __name__ == "__main__":
     population = root_population
     for generation in range(NUMBER_OF_GENERATIONS):
         print(f"Generation: {generation + 1}")
-        population = Population(prev_population=population,
-                                resources=resources,
-                                block_buffer=block_buffer)
-        block_buffer.send_to_server()
+        population = give_with_resends(lambda: population_class(prev_population=population,
+                                                                resources=resources,
+                                                                block_buffer=block_buffer), block_buffer)
+        give_with_resends(lambda: block_buffer.send_to_server(wait=not ASYNC_FLUSH), block_buffer)
+    give_with_resends(block_buffer.barrier, block_buffer)
+    resources.flush()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from minecraft_pb2 import *
+import utils
+
+PHYSICS_WORLD_MIN = (0, 0, 0)  # smallest corner of the simulated world, with BEDROCK at its lowest plane
+PHYSICS_WORLD_MAX = (127, 31, 127)  # largest corner of the simulated world, its top plane is the ceiling
+IMMOVABLE_BLOCK_TYPES = [BEDROCK, PISTON_HEAD, PISTON_EXTENSION]  # (extended pistons cannot be moved either)
+OPPOSITE_ORIENTATIONS = [SOUTH, EAST, NORTH, WEST, DOWN, UP]  # indexed by orientation
+
+
+class PhysicsWorld:
+    """
+    Headless stand-in for the physics of Minecraft on a dense uint8 voxel grid spanning min_coord..max_coord, covering
+    the block types of the simulation:
+    - SAND falls through AIR until it rests on another block (or the floor of the grid),
+    - a (sticky) piston is powered by an adjacent REDSTONE_BLOCK (see utils.RedstonePower). Powered, it extends
+      and pushes the blocks in front of it by one cube, if they are at most PISTON_PUSH_LIMIT blocks. Unpowered, it
+      retracts, and a sticky piston pulls the block in front of its head back along,
+    - SLIME moves the blocks next to it along with it.
+    Cubes outside of the grid are AIR, and blocks are never moved out of it.
+    """
+
+    def __init__(self, min_coord=PHYSICS_WORLD_MIN, max_coord=PHYSICS_WORLD_MAX,
+                 quasi_connectivity=utils.QUASI_CONNECTIVITY):
+        self.min_coord, self.max_coord = utils.give_min_max(min_coord, max_coord)
+        self.size = tuple(self.max_coord[i] - self.min_coord[i] + 1 for i in range(3))
+        self.types = np.full(self.size, AIR, dtype=np.uint8)
+        self.orientations = np.full(self.size, NORTH, dtype=np.uint8)
+        if self.min_coord[1] == 0:
+            self.types[:, 0, :] = BEDROCK
+        self.extended = set()  # grid indices of extended pistons
+        self.power = utils.RedstonePower(self.types, quasi_connectivity=quasi_connectivity)
+
+    def _give_slices(self, min_coord, max_coord):
+        """
+        Returns the slices of the cube min_coord..max_coord clipped to the grid, or None outside of it.
+        """
+        lo = [max(min_coord[i], self.min_coord[i]) - self.min_coord[i] for i in range(3)]
+        hi = [min(max_coord[i], self.max_coord[i]) - self.min_coord[i] for i in range(3)]
+        if any(lo[i] > hi[i] for i in range(3)):
+            return None
+        return tuple(slice(lo[i], hi[i] + 1) for i in range(3))
+
+    def _is_inside(self, index):
+        return all(0 <= index[i] < self.size[i] for i in range(3))
+
+    def set_blocks(self, coords, orientations, block_types):
+        """
+        Writes blocks given as coords of shape (n, 3) and orientations and block_types of shape (n,). Blocks outside
+        of the grid are dropped.
+        """
+        indices = np.asarray(coords, dtype=np.int64).reshape(-1, 3) - np.array(self.min_coord)
+        orientations = np.broadcast_to(np.asarray(orientations, dtype=np.uint8), (len(indices),))
+        block_types = np.broadcast_to(np.asarray(block_types, dtype=np.uint8), (len(indices),))
+        inside = np.all((indices >= 0) & (indices < np.array(self.size)), axis=1)
+        indices, orientations, block_types = indices[inside], orientations[inside], block_types[inside]
+        last = utils.give_last_writes(indices)
+        self._write(indices[last], orientations[last], block_types[last])
+
+    def _write(self, indices, orientations, block_types):
+        """
+        Writes blocks at grid indices of shape (n, 3) without duplicates, keeping the redstone power up to date.
+        """
+        was_redstone = self.types[tuple(indices.T)] == REDSTONE_BLOCK
+        self.types[tuple(indices.T)] = block_types
+        self.orientations[tuple(indices.T)] = orientations
+        self.power.update(indices, was_redstone, np.asarray(block_types) == REDSTONE_BLOCK)
+
+    def fill(self, min_coord, max_coord, block_type):
+        slices = self._give_slices(*utils.give_min_max(min_coord, max_coord))
+        if slices is not None:
+            self.types[slices] = block_type
+            self.orientations[slices] = NORTH
+            self.power.recount()
+
+    def give_types(self, min_coord, max_coord):
+        """
+        Returns the block types of the cube min_coord..max_coord as a dense uint8 array indexed by (x, y, z) relative
+        to min_coord.
+        """
+        region = np.full([max_coord[i] - min_coord[i] + 1 for i in range(3)], AIR, dtype=np.uint8)
+        slices = self._give_slices(min_coord, max_coord)
+        if slices is not None:
+            region[tuple(slice(s.start + self.min_coord[i] - min_coord[i], s.stop + self.min_coord[i] - min_coord[i])
+                         for i, s in enumerate(slices))] = self.types[slices]
+        return region
+
+    def give_powered(self):
+        """
+        Returns the grid indices of all powered (sticky) pistons (see utils.RedstonePower).
+        """
+        return list(map(tuple, self.power.give_powered(self.orientations).tolist()))
+
+    def _is_movable(self, index):
+        return self.types[index] not in IMMOVABLE_BLOCK_TYPES and index not in self.extended
+
+    def _give_structure(self, start, direction, piston):
+        """
+        Returns the grid indices of the blocks that move when the block at start is moved one cube in direction by
+        the piston at grid index piston: the blocks in front of moving blocks are pushed, and the blocks next to moving
+        SLIME are taken along. Returns None if the move is blocked (an immovable block or the border of the grid is in
+        the way, or more than PISTON_PUSH_LIMIT blocks would move).
+        """
+        structure = list()
+        seen = set()
+        stack = [(start, True)]  # (grid index, whether it has to move for the structure to move)
+        while stack:
+            index, required = stack.pop()
+            if index == piston:
+                if required:
+                    return None
+                continue
+            if index in seen:
+                continue
+            if not self._is_inside(index) or self.types[index] == AIR:
+                if required and not self._is_inside(index):
+                    return None
+                continue
+            if not self._is_movable(index):
+                if required:
+                    return None
+                continue
+            seen.add(index)
+            structure.append(index)
+            if len(structure) > utils.PISTON_PUSH_LIMIT:
+                return None
+            stack.append((utils.move_coordinate(index, direction), True))
+            if self.types[index] == SLIME:
+                stack += [(utils.move_coordinate(index, side), False) for side in utils.BLOCK_ORIENTATIONS]
+        return structure
+
+    def _move(self, structure, direction):
+        indices = np.array(structure)
+        types, orientations = self.types[tuple(indices.T)], self.orientations[tuple(indices.T)]
+        self._write(indices, NORTH, np.full(len(indices), AIR, dtype=np.uint8))
+        self._write(indices + utils.SIDE_OFFSETS[direction], orientations, types)
+
+    def _extend(self, piston):
+        direction = int(self.orientations[piston])
+        head = utils.move_coordinate(piston, direction)
+        if not self._is_inside(head):
+            return
+        structure = self._give_structure(head, direction, piston)
+        if structure is None:
+            return
+        if structure:
+            self._move(structure, direction)
+        self._write(np.array([head]), direction, np.array([PISTON_HEAD], dtype=np.uint8))
+        self.extended.add(piston)
+
+    def _retract(self, piston):
+        direction = int(self.orientations[piston])
+        head = utils.move_coordinate(piston, direction)
+        self.extended.discard(piston)
+        if self.types[head] != PISTON_HEAD:  # the head was overwritten meanwhile
+            return
+        self._write(np.array([head]), NORTH, np.array([AIR], dtype=np.uint8))
+        pulled = utils.move_coordinate(head, direction)
+        if self.types[piston] == STICKY_PISTON and self._is_inside(pulled) and self.types[pulled] != AIR:
+            structure = self._give_structure(pulled, OPPOSITE_ORIENTATIONS[direction], piston)
+            if structure:
+                self._move(structure, OPPOSITE_ORIENTATIONS[direction])
+
+    def update_pistons(self):
+        """
+        Extends all powered and retracts all unpowered pistons, in the order of their coordinates.
+        """
+        self.extended = {piston for piston in self.extended if self.types[piston] in (PISTON, STICKY_PISTON)}
+        powered = set(self.give_powered())
+        for piston in sorted(powered - self.extended):
+            if self.types[piston] in (PISTON, STICKY_PISTON):  # it may have been moved by another piston
+                self._extend(piston)
+        for piston in sorted(self.extended - powered):
+            self._retract(piston)
+
+    def settle_sand(self):
+        """
+        Lets all SAND fall through AIR until it rests on another block (see utils.settle_sand). Returns the coords of
+        the moved SAND before and after falling.
+        """
+        moved_from, moved_to = utils.settle_sand(self.types, self.orientations)
+        return moved_from + np.array(self.min_coord), moved_to + np.array(self.min_coord)
+
+    def tick(self):
+        """
+        Applies the physics to the whole grid once: pistons move first, then SAND settles.
+        """
+        self.update_pistons()
+        self.settle_sand()
+
+
+class NumpyBackend(utils.WorldBackend):
+    """
+    World backend keeping the world in memory in a PhysicsWorld instead of the Minecraft server, such that runs need
+    neither Java nor a server, e.g., for parameter sweeps. With physics, every flush is followed by a tick of the
+    physics, otherwise blocks stay where they are put.
+    """
+
+    def __init__(self, world=None, physics=True):
+        self.world = PhysicsWorld() if world is None else world
+        self.physics = physics
+
+    def spawn(self, coords, orientations, block_types):
+        self.world.set_blocks(coords, orientations, block_types)
+
+    def fill(self, min_coord: (int, int, int), max_coord: (int, int, int), block_type: BlockType, progress=None,
+             **options):
+        """
+        Fills the cube at once (tiling and cursors are only needed by the server).
+        """
+        self.world.fill(min_coord, max_coord, block_type)
+        if progress is not None:
+            progress(1, 1)
+
+    def read(self, min_coord: (int, int, int), max_coord: (int, int, int), block_types=None):
+        """
+        Yields the whole cube as a single tile.
+        """
+        region = self.world.give_types(min_coord, max_coord)
+        mask = np.ones(region.shape, dtype=bool) if block_types is None else utils.give_type_mask(region, block_types)
+        yield (np.argwhere(mask) + np.array(min_coord)).astype(np.int32), region[mask]
+
+    def flush(self):
+        if self.physics:
+            self.world.tick()
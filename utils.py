@@ -1,5 +1,13 @@
 #!/usr/bin/env python3
 
+import abc
+import json
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import grpc
 import minecraft_pb2_grpc as mcraft_grpc
 from minecraft_pb2 import *
@@ -7,67 +15,1055 @@ import typing
 
 BLOCK_TYPES = [AIR, SAND, STONE, SLIME, REDSTONE_BLOCK, PISTON, STICKY_PISTON]
 BLOCK_ORIENTATIONS = [NORTH, WEST, SOUTH, EAST, UP, DOWN]  # absolute orientations
+BLOCK_TYPES_SET = frozenset(BLOCK_TYPES)
+BLOCK_ORIENTATIONS_SET = frozenset(BLOCK_ORIENTATIONS)
+SIDE_OFFSETS = ((0, 0, -1), (-1, 0, 0), (0, 0, 1), (1, 0, 0), (0, 1, 0), (0, -1, 0))  # in BLOCK_ORIENTATIONS order
+FILL_CUBE_MAX_VOXELS = 100 * 200 * 100  # larger fillCube requests overload the server
+FILL_CUBE_MAX_IN_FLIGHT = 4  # concurrent fillCube requests
+READ_CUBE_MAX_VOXELS = 100_000  # beyond this, readCube requests overload the server
+READ_CUBE_MAX_IN_FLIGHT = 8  # concurrent readCube requests
+CHUNK_SIZE = 16  # Minecraft stores the world in columns of 16x16 blocks
+WORLD_HEIGHT = 256  # build limit
+UNKNOWN = 255  # block type in the shadow world of cubes the client has neither written nor read
+PISTON_PUSH_LIMIT = 12  # maximal number of blocks a piston moves at once
+QUASI_CONNECTIVITY = False  # whether pistons are also powered through the cube above them, like in Java Edition
+SPAWN_BATCH_SIZE = 4096  # initial number of blocks per spawnBlocks request
+SPAWN_BATCH_SIZE_MIN = 64
+SPAWN_BATCH_SIZE_MAX = 65_536
+SPAWN_BATCH_SIZE_GROWTH = 0.125  # relative increase of the batch size after a fast request
+SPAWN_BATCH_SIZE_PROBE_REQUESTS = 64  # fast requests in a row after which the batch size may exceed its limit again
+SPAWN_TARGET_SECONDS = 0.1  # requests slower than this halve the batch size
+RPC_DEADLINE_SECONDS = 10.0  # deadline of every request of a flush
+RPC_MAX_RETRIES = 3
+RPC_RETRY_BACKOFF_SECONDS = 0.1  # doubled with every retry
+RPC_RETRYABLE_STATUS_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED,
+                              grpc.StatusCode.RESOURCE_EXHAUSTED)
+RPC_OVERLOAD_STATUS_CODES = (grpc.StatusCode.DEADLINE_EXCEEDED, grpc.StatusCode.RESOURCE_EXHAUSTED)  # too big a batch
+COALESCE_MIN_FILL_VOXELS = 8  # smallest box of equal buffered blocks that is sent as a fillCube instead
+NON_AIR_BLOCK_TYPES = [block_type for block_type in BlockType.values() if block_type != AIR]
 
 def move_coordinate(coord: (int, int, int), side_id: int, delta=1):
     """
     Returns new coordinate after a move in a given direction.
     """
-    switcher = [
-        lambda c: (c[0], c[1], c[2] - delta),  # go north
-        lambda c: (c[0] - delta, c[1], c[2]),  # go west
-        lambda c: (c[0], c[1], c[2] + delta),  # go south
-        lambda c: (c[0] + delta, c[1], c[2]),  # go east
-        lambda c: (c[0], c[1] + delta, c[2]),  # go up
-        lambda c: (c[0], c[1] - delta, c[2]),  # go down
-    ]
-    return switcher[side_id](coord)
+    offset = SIDE_OFFSETS[side_id]
+    return coord[0] + offset[0] * delta, coord[1] + offset[1] * delta, coord[2] + offset[2] * delta
 
 
-class BlockBuffer:
+def give_min_max(start_coord: (int, int, int), end_coord: (int, int, int)):
+    """
+    Returns the minimal and maximal corner of the cube spanned by two arbitrary opposite corners.
+    """
+    min_coord = tuple(min(s, e) for s, e in zip(start_coord, end_coord))
+    max_coord = tuple(max(s, e) for s, e in zip(start_coord, end_coord))
+    return min_coord, max_coord
+
+
+def give_cube(min_coord: (int, int, int), max_coord: (int, int, int)):
+    """
+    Returns the Cube message spanning min_coord..max_coord.
+    """
+    return Cube(min=Point(x=min_coord[0], y=min_coord[1], z=min_coord[2]),
+                max=Point(x=max_coord[0], y=max_coord[1], z=max_coord[2]))
+
+
+def decode_blocks(blocks, block_types=None):
+    """
+    Decodes Block messages (e.g., a readCube response) into columnar arrays: int32 coordinates of shape (n, 3) and
+    uint8 block types of shape (n,). If block_types is given, only blocks of these types are kept. As the types are
+    decoded and filtered first, positions are only decoded for the kept blocks, which usually are few (mostly AIR).
+    """
+    types = np.fromiter((block.type for block in blocks), dtype=np.uint8, count=len(blocks))
+    if block_types is None:
+        kept = range(len(blocks))
+    else:
+        kept = np.flatnonzero(give_type_mask(types, block_types)).tolist()
+        types = types[kept]
+    positions = [blocks[i].position for i in kept]
+    coords = np.array([[position.x for position in positions],
+                       [position.y for position in positions],
+                       [position.z for position in positions]], dtype=np.int32).reshape((3, -1)).T
+    return coords, types
+
+
+def give_type_mask(types, block_types):
+    """
+    Returns the boolean mask of the entries of the uint8 array types that are any of block_types.
+    """
+    lookup = np.zeros(256, dtype=bool)
+    lookup[list(block_types)] = True
+    return lookup[types]
+
+
+def scatter_to_grid(coords, types, min_coord: (int, int, int), max_coord: (int, int, int), fill_value=AIR):
+    """
+    Scatters block types at coords into a dense uint8 grid spanning min_coord..max_coord, indexed by (x, y, z) relative
+    to min_coord. Cubes without a block are fill_value, blocks outside of the grid are dropped.
+    """
+    grid = np.full([max_coord[i] - min_coord[i] + 1 for i in range(3)], fill_value, dtype=np.uint8)
+    local = coords - np.asarray(min_coord)
+    inside = np.all((local >= 0) & (local < grid.shape), axis=1)
+    grid[tuple(local[inside].T)] = types[inside]
+    return grid
+
+
+def settle_sand(types, orientations=None, ceiling=None):
+    """
+    Lets SAND fall through AIR in a dense uint8 grid indexed by (x, y, z), in place. Per column, the SAND between two
+    other blocks is compacted onto the lower one with a few whole-array passes (cumulative sums over y); below the
+    grid is the floor. With ceiling, only the cubes up to that y index take part. Orientations (if given) move along.
+    Returns the grid indices of the moved SAND before and after falling, both of shape (n, 3).
+    """
+    columns = types if ceiling is None else types[:, :ceiling + 1, :]
+    # Only columns with SAND right above AIR change, SAND everywhere else already rests on something.
+    falling = (columns[:, 1:, :] == SAND) & (columns[:, :-1, :] == AIR)
+    column_x, column_z = np.nonzero(falling.any(axis=1))
+    if len(column_x) == 0:
+        return np.zeros((0, 3), dtype=np.int64), np.zeros((0, 3), dtype=np.int64)
+    columns = columns[column_x, :, column_z]  # shape (columns, y)
+    sand = columns == SAND
+    y = np.arange(columns.shape[1])[None, :]
+    last_support = np.maximum.accumulate(np.where((columns != AIR) & ~sand, y, -1), axis=1)
+    sand_count = np.cumsum(sand, axis=1, dtype=np.int32)  # SAND at or below every cube
+    padded = np.concatenate([np.zeros_like(sand_count[:, :1]), sand_count], axis=1)
+    targets = last_support + sand_count - np.take_along_axis(padded, last_support + 1, axis=1)
+    column, moved_y = np.nonzero(sand & (targets != y))
+    moved_from = np.stack([column_x[column], moved_y, column_z[column]], axis=1).astype(np.int64)
+    moved_to = moved_from.copy()
+    moved_to[:, 1] = targets[column, moved_y]
+    if len(moved_from):
+        from_indices, to_indices = tuple(moved_from.T), tuple(moved_to.T)
+        types[from_indices] = AIR
+        types[to_indices] = SAND
+        if orientations is not None:
+            moved_orientations = orientations[from_indices]
+            orientations[from_indices] = NORTH
+            orientations[to_indices] = moved_orientations
+    return moved_from, moved_to
+
+
+def give_coord_keys(coords):
+    """
+    Packs coordinates of shape (n, 3) into unique int64 keys (x and z within +-2^25 cover the whole Minecraft world).
+    """
+    coords = coords.astype(np.int64)
+    return ((coords[:, 0] + (1 << 25)) << 35) | ((coords[:, 1] + (1 << 8)) << 26) | (coords[:, 2] + (1 << 25))
+
+
+def give_last_writes(coords):
+    """
+    Returns the sorted indices of the last occurrence of every coordinate in coords of shape (n, 3).
+    """
+    keys = give_coord_keys(coords)
+    _, first_reversed = np.unique(keys[::-1], return_index=True)
+    return np.sort(len(keys) - 1 - first_reversed)
+
+
+def _merge_consecutive(groups, values, lo, hi):
+    """
+    Merges intervals lo..hi of consecutive values (one per item) sharing the same group columns.
+    Returns the group columns, the first and last value of every merged interval, and the merged index of every item.
+    """
+    order = np.lexsort((values,) + tuple(groups[:, i] for i in reversed(range(groups.shape[1]))))
+    groups, values = groups[order], values[order]
+    starts = np.ones(len(values), dtype=bool)
+    starts[1:] = np.any(groups[1:] != groups[:-1], axis=1) | (values[1:] != values[:-1] + 1)
+    merged = np.cumsum(starts) - 1
+    item_merged = np.empty(len(values), dtype=np.int64)
+    item_merged[order] = merged
+    first = np.flatnonzero(starts)
+    last = np.append(first[1:], len(values)) - 1
+    return groups[first], lo[order][first], hi[order][last], item_merged
+
+
+def give_fill_boxes(coords, block_types, min_voxels=COALESCE_MIN_FILL_VOXELS, max_voxels=FILL_CUBE_MAX_VOXELS):
+    """
+    Greedily merges unique coords with equal block types into boxes: runs along x, then rectangles along z and finally
+    boxes along y. Returns the minimal and maximal corners and block types of all boxes with min_voxels..max_voxels
+    cubes, and for every coordinate the index of its box (-1 if it is not part of any returned box).
+    """
+    if len(coords) == 0:
+        return np.zeros((0, 3), np.int32), np.zeros((0, 3), np.int32), np.zeros(0, np.uint8), np.zeros(0, np.int64)
+    x, y, z, t = coords[:, 0], coords[:, 1], coords[:, 2], block_types.astype(np.int32)
+    runs, x_lo, x_hi, block_run = _merge_consecutive(np.stack([t, y, z], axis=1), x, x, x)
+    rects, z_lo, z_hi, run_rect = _merge_consecutive(
+        np.stack([runs[:, 0], runs[:, 1], x_lo, x_hi], axis=1), runs[:, 2], runs[:, 2], runs[:, 2])
+    boxes, y_lo, y_hi, rect_box = _merge_consecutive(
+        np.stack([rects[:, 0], rects[:, 2], rects[:, 3], z_lo, z_hi], axis=1), rects[:, 1], rects[:, 1], rects[:, 1])
+    box_min = np.stack([boxes[:, 1], y_lo, boxes[:, 3]], axis=1).astype(np.int32)
+    box_max = np.stack([boxes[:, 2], y_hi, boxes[:, 4]], axis=1).astype(np.int32)
+    volumes = np.prod(box_max.astype(np.int64) - box_min + 1, axis=1)
+    selected = (volumes >= min_voxels) & (volumes <= max_voxels)
+    new_index = np.where(selected, np.cumsum(selected) - 1, -1)
+    return box_min[selected], box_max[selected], boxes[selected, 0].astype(np.uint8), \
+        new_index[rect_box[run_rect[block_run]]]
+
+
+def give_tiles(min_coord: (int, int, int), max_coord: (int, int, int), max_voxels: int, align=1):
     """
-    Blocks are buffered here and then sent to the Minecraft server.
+    Splits the cube min_coord..max_coord (both inclusive) into tiles of at most max_voxels voxels.
+    Tiles span whole y-columns if the budget allows it and are square in the x-z plane. Their x/z borders lie on
+    multiples of the tile side, which is itself a multiple of align (e.g., 16 for Minecraft chunks), such that a tile
+    is never smaller than a single aligned column. Tiles are returned in a fixed (x, z, y) order.
     """
+    lens = [mx - mn + 1 for mn, mx in zip(min_coord, max_coord)]
+    if lens[0] * lens[1] * lens[2] <= max_voxels:
+        return [(tuple(min_coord), tuple(max_coord))]
+
+    y_side = max(1, min(lens[1], max_voxels // (align * align)))
+    side = max(align, int(math.sqrt(max_voxels // y_side)) // align * align)
+    tiles = list()
+    for x in range(min_coord[0] // align * align, max_coord[0] + 1, side):
+        for z in range(min_coord[2] // align * align, max_coord[2] + 1, side):
+            for y in range(min_coord[1], max_coord[1] + 1, y_side):
+                tiles.append(((max(x, min_coord[0]), y, max(z, min_coord[2])),
+                              (min(x + side - 1, max_coord[0]), min(y + y_side - 1, max_coord[1]),
+                               min(z + side - 1, max_coord[2]))))
+    return tiles
+
+
+def give_mask_boxes(mask, min_coord: (int, int, int)):
+    """
+    Returns boxes, as (min_coord, max_coord) pairs, exactly covering the True cubes of the boolean grid mask whose
+    origin is at min_coord, merged greedily like give_fill_boxes.
+    """
+    coords = np.argwhere(mask)
+    box_min, box_max, _, _ = give_fill_boxes(coords, np.zeros(len(coords), dtype=np.uint8), min_voxels=1,
+                                             max_voxels=mask.size)
+    return list(zip((box_min + np.array(min_coord)).tolist(), (box_max + np.array(min_coord)).tolist()))
+
+
+def read_tile_cursor(path: str, job: dict):
+    """
+    Returns the number of tiles of job that were already completed according to the cursor file at path.
+    A missing cursor file or a cursor of another job means that nothing was done yet.
+    """
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        cursor = json.load(f)
+    return cursor["done"] if cursor["job"] == job else 0
+
+
+def write_tile_cursor(path: str, job: dict, done: int):
+    """
+    Atomically persists the number of completed tiles of job, so that a crash never leaves a half-written cursor.
+    """
+    with open(path + ".tmp", "w") as f:
+        json.dump({"job": job, "done": done}, f)
+    os.replace(path + ".tmp", path)
+
+
+class FlushError(Exception):
+    """
+    Raised when a flush failed for good. Blocks in sent were written, blocks in unsent were not; both are given as
+    (coords, orientations, block types) arrays.
+    """
+
+    def __init__(self, sent, unsent):
+        super().__init__(f"{len(unsent[0])} blocks could not be sent to the server")
+        self.sent = sent
+        self.unsent = unsent
+
+
+class RedstonePower:
+    """
+    Power state of the (sticky) pistons in a voxel grid of block types. A REDSTONE_BLOCK powers the 6 cubes next to it
+    but does not conduct power any further (and neither do other blocks), so instead of labeling connected components
+    the solver keeps the number of REDSTONE_BLOCKs next to every cube as int8 and updates it for changed cubes only.
+    A piston is powered if a REDSTONE_BLOCK is next to it on any side but its front, or, with quasi_connectivity, next
+    to the cube above it.
+    """
+
+    def __init__(self, types, quasi_connectivity=QUASI_CONNECTIVITY):
+        self.types = types  # shared with the world, which reports all changes via update
+        self.quasi_connectivity = quasi_connectivity
+        self.counts = np.zeros(types.shape, dtype=np.int8)  # REDSTONE_BLOCKs next to every cube
+        self.recount()
+
+    def recount(self):
+        """
+        Recounts the REDSTONE_BLOCKs next to all cubes, with one shifted sum per side.
+        """
+        redstone = (self.types == REDSTONE_BLOCK).astype(np.int8)
+        self.counts[:] = 0
+        for axis in range(3):
+            lower = [slice(None)] * 3
+            upper = [slice(None)] * 3
+            lower[axis], upper[axis] = slice(None, -1), slice(1, None)
+            self.counts[tuple(lower)] += redstone[tuple(upper)]
+            self.counts[tuple(upper)] += redstone[tuple(lower)]
+
+    def update(self, indices, was_redstone, is_redstone):
+        """
+        Updates the counts after the cubes at grid indices of shape (n, 3) (without duplicates) changed, given
+        whether they held a REDSTONE_BLOCK before and after.
+        """
+        changed = was_redstone != is_redstone
+        if not changed.any():
+            return
+        indices, delta = indices[changed], np.where(is_redstone[changed], 1, -1).astype(np.int8)
+        for offset in SIDE_OFFSETS:
+            neighbors = indices + offset
+            inside = np.all((neighbors >= 0) & (neighbors < self.counts.shape), axis=1)
+            np.add.at(self.counts, tuple(neighbors[inside].T), delta[inside])
+
+    def give_powered(self, orientations):
+        """
+        Returns the grid indices of the powered (sticky) pistons as an array of shape (n, 3).
+        """
+        pistons = np.argwhere(np.isin(self.types, [PISTON, STICKY_PISTON]))
+        fronts = pistons + np.array(SIDE_OFFSETS)[orientations[tuple(pistons.T)]]
+        inside = np.all((fronts >= 0) & (fronts < self.types.shape), axis=1)
+        front_redstone = np.zeros(len(pistons), dtype=np.int16)
+        front_redstone[inside] = self.types[tuple(fronts[inside].T)] == REDSTONE_BLOCK
+        powered = self.counts[tuple(pistons.T)] - front_redstone > 0
+        if self.quasi_connectivity:
+            above = pistons[:, 1] + 1 < self.types.shape[1]
+            powered[above] |= self.counts[pistons[above, 0], pistons[above, 1] + 1, pistons[above, 2]] > 0
+        return pistons[powered]
+
+
+class ShadowWorld:
+    """
+    Client-side mirror of the Minecraft world. It is built from the blocks the client sent to the server itself and is
+    only reconciled with readCube responses where physics may have moved blocks. Unlike Minecraft, it also remembers
+    the orientation of blocks.
+    Block types and orientations are kept as uint8 in columns of CHUNK_SIZE x WORLD_HEIGHT x CHUNK_SIZE cubes, which
+    are allocated when first written to. Cubes that were neither written nor read are UNKNOWN.
+    """
+
     def __init__(self):
-        self._blocks = list()
-        self._channel = grpc.insecure_channel('localhost:5001')
-        self._client = mcraft_grpc.MinecraftServiceStub(self._channel)
+        self._types = dict()  # (chunk x, chunk z) -> block types of the chunk
+        self._orientations = dict()  # (chunk x, chunk z) -> orientations of the chunk
+        self._fills = list()  # all filled cubes, applied to chunks upon allocation
+
+    @staticmethod
+    def _give_chunk_slices(key, min_coord, max_coord):
+        """
+        Returns the slices of the intersection of the cube min_coord..max_coord with chunk key in chunk coordinates,
+        or None if they do not intersect.
+        """
+        chunk_min = (key[0] * CHUNK_SIZE, 0, key[1] * CHUNK_SIZE)
+        chunk_max = (chunk_min[0] + CHUNK_SIZE - 1, WORLD_HEIGHT - 1, chunk_min[2] + CHUNK_SIZE - 1)
+        lo = [max(min_coord[i], chunk_min[i]) for i in range(3)]
+        hi = [min(max_coord[i], chunk_max[i]) for i in range(3)]
+        if any(lo[i] > hi[i] for i in range(3)):
+            return None
+        return tuple(slice(lo[i] - chunk_min[i], hi[i] - chunk_min[i] + 1) for i in range(3))
+
+    @staticmethod
+    def _give_chunk_keys(min_coord, max_coord):
+        return [(cx, cz) for cx in range(min_coord[0] // CHUNK_SIZE, max_coord[0] // CHUNK_SIZE + 1)
+                for cz in range(min_coord[2] // CHUNK_SIZE, max_coord[2] // CHUNK_SIZE + 1)]
+
+    def _give_chunk(self, key, allocate=True):
+        """
+        Returns the block types and orientations of chunk key. Without allocate, a chunk that was not allocated yet
+        is built temporarily from the filled cubes.
+        """
+        if key in self._types:
+            return self._types[key], self._orientations[key]
+        types = np.full((CHUNK_SIZE, WORLD_HEIGHT, CHUNK_SIZE), UNKNOWN, dtype=np.uint8)
+        orientations = np.full((CHUNK_SIZE, WORLD_HEIGHT, CHUNK_SIZE), NORTH, dtype=np.uint8)
+        for min_coord, max_coord, block_type in self._fills:
+            slices = self._give_chunk_slices(key, min_coord, max_coord)
+            if slices is not None:
+                types[slices] = block_type
+        if allocate:
+            self._types[key], self._orientations[key] = types, orientations
+        return types, orientations
+
+    def set_block(self, coord: (int, int, int), orientation: int, block_type: int):
+        assert 0 <= coord[1] < WORLD_HEIGHT, f"Coordinate outside of the world: {coord}"
+        types, orientations = self._give_chunk((coord[0] // CHUNK_SIZE, coord[2] // CHUNK_SIZE))
+        local = (coord[0] % CHUNK_SIZE, coord[1], coord[2] % CHUNK_SIZE)
+        types[local] = block_type
+        orientations[local] = orientation
+
+    def give_blocks_at(self, coords):
+        """
+        Returns the block types and orientations at coords of shape (n, 3), without allocating chunks.
+        """
+        types = np.full(len(coords), UNKNOWN, dtype=np.uint8)
+        orientations = np.full(len(coords), NORTH, dtype=np.uint8)
+        inside = np.flatnonzero((coords[:, 1] >= 0) & (coords[:, 1] < WORLD_HEIGHT))
+        if len(inside) == 0:
+            return types, orientations
+        keys = coords[inside][:, [0, 2]] // CHUNK_SIZE
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        for k, key in enumerate(map(tuple, unique_keys.tolist())):
+            indices = inside[inverse == k]
+            chunk_types, chunk_orientations = self._give_chunk(key, allocate=False)
+            local = (coords[indices, 0] % CHUNK_SIZE, coords[indices, 1], coords[indices, 2] % CHUNK_SIZE)
+            types[indices] = chunk_types[local]
+            orientations[indices] = chunk_orientations[local]
+        return types, orientations
+
+    def set_blocks(self, coords, orientations, block_types):
+        """
+        Sets many blocks at once, given coords of shape (n, 3) and orientations and block_types of shape (n,).
+        """
+        if len(coords) == 0:
+            return
+        assert coords[:, 1].min() >= 0 and coords[:, 1].max() < WORLD_HEIGHT, "Coordinate outside of the world"
+        keys = coords[:, [0, 2]] // CHUNK_SIZE
+        local = (coords[:, 0] % CHUNK_SIZE, coords[:, 1], coords[:, 2] % CHUNK_SIZE)
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        order = np.argsort(inverse.ravel(), kind="stable")
+        bounds = np.searchsorted(inverse.ravel()[order], np.arange(len(unique_keys) + 1))
+        for k, key in enumerate(map(tuple, unique_keys.tolist())):
+            indices = order[bounds[k]:bounds[k + 1]]
+            types, chunk_orientations = self._give_chunk(key)
+            chunk_local = tuple(axis[indices] for axis in local)
+            types[chunk_local] = block_types[indices]
+            chunk_orientations[chunk_local] = orientations[indices]
+
+    def fill(self, min_coord: (int, int, int), max_coord: (int, int, int), block_type: int):
+        """
+        Fills the cube min_coord..max_coord with blocks of block_type. Only allocated chunks are touched, the others
+        pick the fill up once they get allocated, such that filling the whole game field is cheap.
+        """
+        assert 0 <= min_coord[1] and max_coord[1] < WORLD_HEIGHT, "Cube outside of the world"
+        n_keys = (max_coord[0] // CHUNK_SIZE - min_coord[0] // CHUNK_SIZE + 1) * \
+                 (max_coord[2] // CHUNK_SIZE - min_coord[2] // CHUNK_SIZE + 1)
+        if n_keys > len(self._types) or \
+                not all(key in self._types for key in self._give_chunk_keys(min_coord, max_coord)):
+            self._fills.append((tuple(min_coord), tuple(max_coord), block_type))
+        for key in self._types.keys():
+            slices = self._give_chunk_slices(key, min_coord, max_coord)
+            if slices is not None:
+                self._types[key][slices] = block_type
+                self._orientations[key][slices] = NORTH
+
+    def give_type(self, coord: (int, int, int)):
+        """
+        Returns the block type at coord (UNKNOWN if the client does not know it).
+        """
+        if not 0 <= coord[1] < WORLD_HEIGHT:
+            return UNKNOWN
+        key = (coord[0] // CHUNK_SIZE, coord[2] // CHUNK_SIZE)
+        if key in self._types:
+            return int(self._types[key][coord[0] % CHUNK_SIZE, coord[1], coord[2] % CHUNK_SIZE])
+        for min_coord, max_coord, block_type in reversed(self._fills):
+            if all(min_coord[i] <= coord[i] <= max_coord[i] for i in range(3)):
+                return block_type
+        return UNKNOWN
+
+    def give_orientation(self, coord: (int, int, int)):
+        """
+        Returns the orientation at coord (NORTH if the client does not know it).
+        """
+        if not 0 <= coord[1] < WORLD_HEIGHT:
+            return NORTH
+        key = (coord[0] // CHUNK_SIZE, coord[2] // CHUNK_SIZE)
+        if key in self._orientations:
+            return int(self._orientations[key][coord[0] % CHUNK_SIZE, coord[1], coord[2] % CHUNK_SIZE])
+        return NORTH
+
+    def is_occupied(self, coord: (int, int, int)):
+        """
+        Returns whether the cube at coord is known to hold a block other than AIR.
+        """
+        return self.give_type(coord) not in (AIR, UNKNOWN)
+
+    def give_types(self, min_coord: (int, int, int), max_coord: (int, int, int)):
+        """
+        Returns the block types of the cube min_coord..max_coord as a dense uint8 array indexed by (x, y, z) relative
+        to min_coord.
+        """
+        region = np.full([max_coord[i] - min_coord[i] + 1 for i in range(3)], UNKNOWN, dtype=np.uint8)
+        clipped_min = (min_coord[0], max(min_coord[1], 0), min_coord[2])
+        clipped_max = (max_coord[0], min(max_coord[1], WORLD_HEIGHT - 1), max_coord[2])
+        for key in self._give_chunk_keys(clipped_min, clipped_max):
+            slices = self._give_chunk_slices(key, clipped_min, clipped_max)
+            if slices is None:
+                continue
+            types, _ = self._give_chunk(key, allocate=False)
+            offset = (key[0] * CHUNK_SIZE - min_coord[0], -min_coord[1], key[1] * CHUNK_SIZE - min_coord[2])
+            region[tuple(slice(s.start + o, s.stop + o) for s, o in zip(slices, offset))] = types[slices]
+        return region
+
+    def reconcile(self, min_coord: (int, int, int), max_coord: (int, int, int), coords, types):
+        """
+        Overwrites the cube min_coord..max_coord with the blocks read from the server, given as decoded coords and
+        types. Cubes without a block are AIR. Orientations are kept where the block type did not change, as Minecraft
+        does not report them.
+        """
+        read_types = scatter_to_grid(coords, types, min_coord, max_coord)
+        changed = self.give_types(min_coord, max_coord) != read_types
+        for key in self._give_chunk_keys(min_coord, max_coord):
+            slices = self._give_chunk_slices(key, min_coord, max_coord)
+            if slices is None:
+                continue
+            chunk_types, chunk_orientations = self._give_chunk(key)
+            offset = (key[0] * CHUNK_SIZE - min_coord[0], -min_coord[1], key[1] * CHUNK_SIZE - min_coord[2])
+            region_slices = tuple(slice(s.start + o, s.stop + o) for s, o in zip(slices, offset))
+            chunk_types[slices] = read_types[region_slices]
+            chunk_orientations[slices][changed[region_slices]] = NORTH
+
+    def settle_sand(self, min_coord: (int, int, int), max_coord: (int, int, int)):
+        """
+        Lets the SAND within the cube min_coord..max_coord fall like Minecraft does (see settle_sand), where UNKNOWN
+        cubes and the floor of the cube hold it. Returns the coords of the moved SAND before and after falling.
+        """
+        moved_from, moved_to = settle_sand(self.give_types(min_coord, max_coord))
+        if len(moved_from) == 0:
+            return moved_from, moved_to
+        moved_from, moved_to = moved_from + np.asarray(min_coord), moved_to + np.asarray(min_coord)
+        _, orientations = self.give_blocks_at(moved_from)
+        self.set_blocks(moved_from, np.full(len(moved_from), NORTH, dtype=np.uint8),
+                        np.full(len(moved_from), AIR, dtype=np.uint8))
+        self.set_blocks(moved_to, orientations, np.full(len(moved_to), SAND, dtype=np.uint8))
+        return moved_from, moved_to
+
+    def _give_piston_boxes(self, min_coord: (int, int, int), max_coord: (int, int, int)):
+        """
+        Returns boxes exactly covering the cubes of the (sticky) pistons within min_coord..max_coord that may extend or
+        retract, i.e., whose state (extended if a PISTON_HEAD is in front of it) may not match their power.
+        Powered counts conservatively here: UNKNOWN cubes may be REDSTONE_BLOCKs and the cube above may power a piston
+        (see RedstonePower). Pistons that are powered and extended or unpowered and retracted stay as they are.
+        The box of a piston spans the piston and the cubes in front of it up to the first AIR, as far as
+        PISTON_PUSH_LIMIT blocks can be moved, and down to min_coord, as moved SAND may fall. Only if SLIME (or UNKNOWN)
+        is among the moved blocks, it is widened sideways by PISTON_PUSH_LIMIT and to the full reach for the blocks the
+        SLIME drags along.
+        """
+        reach = PISTON_PUSH_LIMIT + 1
+        padded_min = np.array(min_coord) - reach
+        types = self.give_types(tuple(padded_min.tolist()), tuple(c + reach for c in max_coord))
+        pistons = np.argwhere(np.isin(types, [PISTON, STICKY_PISTON]))
+        if len(pistons) == 0:
+            return list()
+        orientations = np.zeros(types.shape, dtype=np.uint8)
+        orientations[tuple(pistons.T)] = self.give_blocks_at(pistons + padded_min)[1]
+        surely_powered = np.zeros(types.shape, dtype=bool)
+        surely_powered[tuple(RedstonePower(types, quasi_connectivity=False).give_powered(orientations).T)] = True
+        maybe_powered = np.zeros(types.shape, dtype=bool)
+        maybe_powered[tuple(RedstonePower(np.where(types == UNKNOWN, REDSTONE_BLOCK, types).astype(np.uint8),
+                                          quasi_connectivity=True).give_powered(orientations).T)] = True
+
+        pistons = pistons[np.all((pistons >= reach) & (pistons < np.array(types.shape) - reach), axis=1)]
+        directions = np.array(SIDE_OFFSETS)[orientations[tuple(pistons.T)]]
+        lines = pistons[:, None, :] + directions[:, None, :] * np.arange(1, reach + 1)[None, :, None]
+        line_types = types[tuple(lines.transpose(2, 0, 1))]  # (pistons, reach) cubes in front of every piston
+        extended = line_types[:, 0] == PISTON_HEAD
+        retracted = ~give_type_mask(line_types[:, 0], [PISTON_HEAD, UNKNOWN])
+        stable = (surely_powered[tuple(pistons.T)] & extended) | (~maybe_powered[tuple(pistons.T)] & retracted)
+        pistons, directions, line_types = pistons[~stable], directions[~stable], line_types[~stable]
+        if len(pistons) == 0:
+            return list()
+
+        occupied = line_types != AIR
+        moved = np.where(occupied.all(axis=1), reach, occupied.argmin(axis=1))  # blocks in front up to the first AIR
+        drags = (give_type_mask(line_types, [SLIME, UNKNOWN]) & (np.arange(reach) < moved[:, None])).any(axis=1)
+        ends = pistons + directions * np.where(drags, reach, np.minimum(moved + 1, reach))[:, None]
+        margins = (directions == 0) * np.where(drags, PISTON_PUSH_LIMIT, 0)[:, None]
+        box_min = np.maximum(np.minimum(pistons, ends) - margins + padded_min, min_coord) - min_coord
+        box_max = np.minimum(np.maximum(pistons, ends) + margins + padded_min, max_coord) - min_coord
+        box_min[:, 1] = 0
+
+        # The union of the boxes is painted at once into a difference grid, whose prefix sums count the boxes per cube.
+        counts = np.zeros([max_coord[i] - min_coord[i] + 2 for i in range(3)], dtype=np.int32)
+        for corner in np.ndindex(2, 2, 2):
+            indices = np.where(np.array(corner, dtype=bool), box_max + 1, box_min)
+            np.add.at(counts, tuple(indices.T), (-1) ** sum(corner))
+        for axis in range(3):
+            np.cumsum(counts, axis=axis, out=counts)
+        return give_mask_boxes(counts[:-1, :-1, :-1] > 0, min_coord)
+
+    def give_physics_boxes(self, min_coord: (int, int, int), max_coord: (int, int, int)):
+        """
+        Returns the cubes within min_coord..max_coord in which Minecraft physics may have moved blocks since they were
+        written, i.e., the only parts that need a reconciling readCube:
+        - around the (sticky) pistons that may extend or retract, the blocks they can move (see _give_piston_boxes),
+        - the columns below SAND down to min_coord where the SAND is not known to rest on a block (after settle_sand,
+          only SAND on UNKNOWN cubes is left),
+        - all cubes whose block type is UNKNOWN.
+        """
+        types = self.give_types(min_coord, max_coord)
+        unsupported_sand = np.zeros(types.shape, dtype=bool)
+        unsupported_sand[:, 1:, :] = (types[:, 1:, :] == SAND) & np.isin(types[:, :-1, :], [AIR, UNKNOWN])
+        boxes = self._give_piston_boxes(min_coord, max_coord)
+        for mask, down_to_floor in [(unsupported_sand, True), (types == UNKNOWN, False)]:
+            coords = np.argwhere(mask)
+            if len(coords) == 0:
+                continue
+            box_min = [min_coord[i] + int(coords[:, i].min()) for i in range(3)]
+            box_max = [min_coord[i] + int(coords[:, i].max()) for i in range(3)]
+            if down_to_floor:
+                box_min[1] = min_coord[1]
+            boxes.append((box_min, box_max))
+        return boxes
+
+
+class WorldBackend(abc.ABC):
+    """
+    Interface of the worlds a BlockBuffer writes to and reads from, such that a run can swap the Minecraft server for
+    another world without touching the simulation:
+    - spawn(coords, orientations, block_types) writes blocks given as coords of shape (n, 3) and orientations and
+      block_types of shape (n,), raising a FlushError with the sent and unsent blocks if it fails halfway,
+    - fill(min_coord, max_coord, block_type, **options) fills a cube with blocks of block_type facing NORTH,
+    - read(min_coord, max_coord, block_types=None) yields the blocks of a cube (only those of block_types, if given)
+      tile by tile as int32 coords of shape (n, 3) and uint8 block types, where a cube without any block is AIR,
+    - flush() completes everything written so far (e.g., lets physics happen).
+    physics tells whether blocks may move after being written, i.e., whether the shadow world needs reconciling.
+    """
+    physics = True
+
+    @abc.abstractmethod
+    def spawn(self, coords, orientations, block_types):
+        pass
+
+    @abc.abstractmethod
+    def fill(self, min_coord: (int, int, int), max_coord: (int, int, int), block_type: BlockType, **options):
+        pass
+
+    @abc.abstractmethod
+    def read(self, min_coord: (int, int, int), max_coord: (int, int, int), block_types=None):
+        pass
+
+    def flush(self):
+        pass
+
+
+class GrpcBackend(WorldBackend):
+    """
+    The Minecraft server, reached via gRPC.
+    Blocks are spawned in batches whose size adapts to the latency of the server (small relative increase up to a limit
+    below the last overloading size, multiplicative decrease). Requests have deadlines and are retried on transient
+    errors.
+    """
+
+    def __init__(self, address='localhost:5001', client=None):
+        """
+        Connects to the Minecraft server at address, unless another client with the interface of
+        minecraft_pb2_grpc.MinecraftServiceStub is given (e.g., fake_server.InProcessStub).
+        """
+        self.spawn_batch_size = SPAWN_BATCH_SIZE
+        self._spawn_batch_limit = SPAWN_BATCH_SIZE_MAX  # one growth step below the last overloading batch size
+        self._fast_requests = 0  # in a row, since the batch size was last shrunk
+        if client is None:
+            self._channel = grpc.insecure_channel(address)
+            self._client = mcraft_grpc.MinecraftServiceStub(self._channel)
+        else:
+            self._channel = None
+            self._client = client
+
+    def _shrink_spawn_batch_size(self):
+        """
+        Halves the batch size after a request that overloaded the server, and limits its growth to one growth step
+        below the overloading size, such that it settles instead of overloading the server again and again.
+        """
+        self._spawn_batch_limit = max(SPAWN_BATCH_SIZE_MIN, int(self.spawn_batch_size * (1 - SPAWN_BATCH_SIZE_GROWTH)))
+        self.spawn_batch_size = max(SPAWN_BATCH_SIZE_MIN, self.spawn_batch_size // 2)
+        self._fast_requests = 0
+
+    def _adapt_spawn_batch_size(self, seconds):
+        if seconds > SPAWN_TARGET_SECONDS:
+            self._shrink_spawn_batch_size()
+            return
+        self._fast_requests += 1
+        if self._fast_requests == SPAWN_BATCH_SIZE_PROBE_REQUESTS:  # the server may cope with more by now
+            self._spawn_batch_limit = SPAWN_BATCH_SIZE_MAX
+            self._fast_requests = 0
+        growth = max(1, int(self.spawn_batch_size * SPAWN_BATCH_SIZE_GROWTH))
+        self.spawn_batch_size = min(self._spawn_batch_limit, self.spawn_batch_size + growth)
+
+    def _call(self, method, request):
+        """
+        Calls method with request under a deadline, retrying transient errors RPC_MAX_RETRIES times with exponential
+        backoff.
+        """
+        for attempt in range(RPC_MAX_RETRIES + 1):
+            try:
+                return method(request, timeout=RPC_DEADLINE_SECONDS)
+            except grpc.RpcError as e:
+                if e.code() not in RPC_RETRYABLE_STATUS_CODES or attempt == RPC_MAX_RETRIES:
+                    raise
+                time.sleep(RPC_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+    def _spawn_batch(self, coords, orientations, block_types):
+        """
+        Sends the first spawn_batch_size of the blocks in a spawnBlocks request and adapts the batch size to the
+        latency of the server. A server overloaded by the batch (RPC_OVERLOAD_STATUS_CODES) is retried right away with
+        a halved batch as long as it can still shrink, which is backoff enough. Other transient errors are retried like
+        in _call. Returns the number of blocks sent.
+        """
+        attempt = 0
+        while True:
+            n_blocks = min(self.spawn_batch_size, len(coords))
+            request = Blocks(blocks=[
+                Block(position=Point(x=x, y=y, z=z), type=block_type, orientation=orientation)
+                for (x, y, z), orientation, block_type in zip(coords[:n_blocks].tolist(),
+                                                              orientations[:n_blocks].tolist(),
+                                                              block_types[:n_blocks].tolist())])
+            t_0 = time.time()
+            try:
+                self._client.spawnBlocks(request, timeout=RPC_DEADLINE_SECONDS)
+            except grpc.RpcError as e:
+                if e.code() in RPC_OVERLOAD_STATUS_CODES and self.spawn_batch_size > SPAWN_BATCH_SIZE_MIN:
+                    self._shrink_spawn_batch_size()
+                    continue
+                if e.code() not in RPC_RETRYABLE_STATUS_CODES or attempt == RPC_MAX_RETRIES:
+                    raise
+                time.sleep(RPC_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+                attempt += 1
+                continue
+            self._adapt_spawn_batch_size(time.time() - t_0)
+            return n_blocks
+
+    def spawn(self, coords, orientations, block_types):
+        """
+        Boxes of at least COALESCE_MIN_FILL_VOXELS equal blocks facing NORTH (the orientation fillCube produces) are
+        sent as fillCube requests, all other blocks in spawnBlocks requests of spawn_batch_size blocks. The Block
+        messages are only built here, right before sending.
+        """
+        fillable = np.flatnonzero(orientations == NORTH)
+        box_min, box_max, box_types, box_ids = give_fill_boxes(coords[fillable], block_types[fillable])
+        spawned = np.ones(len(coords), dtype=bool)
+        spawned[fillable[box_ids >= 0]] = False
+        sent = np.zeros(len(coords), dtype=bool)
+
+        try:
+            for box_id, (cube_min, cube_max, box_type) in enumerate(zip(box_min.tolist(), box_max.tolist(),
+                                                                        box_types.tolist())):
+                self._call(self._client.fillCube, FillCubeRequest(cube=give_cube(cube_min, cube_max), type=box_type))
+                sent[fillable[box_ids == box_id]] = True
+
+            remaining = np.flatnonzero(spawned)
+            while len(remaining):
+                batch = remaining[:self.spawn_batch_size]
+                n_sent = self._spawn_batch(coords[batch], orientations[batch], block_types[batch])
+                sent[remaining[:n_sent]] = True
+                remaining = remaining[n_sent:]
+        except grpc.RpcError as e:
+            raise FlushError(sent=(coords[sent], orientations[sent], block_types[sent]),
+                             unsent=(coords[~sent], orientations[~sent], block_types[~sent])) from e
+
+    def fill(self, min_coord: (int, int, int), max_coord: (int, int, int), block_type: BlockType,
+             max_voxels=FILL_CUBE_MAX_VOXELS, max_in_flight=FILL_CUBE_MAX_IN_FLIGHT, cursor_path=None, progress=None):
+        """
+        Cubes larger than max_voxels are split into tiles (big requests kill the server), of which at most
+        max_in_flight are sent to the server at once.
+        If cursor_path is given, the number of completed tiles is persisted there after every tile, such that a fill
+        interrupted by a crash resumes at the first unfinished tile. The cursor file is removed once the fill is done.
+        If given, progress(done, total) is called after every completed tile.
+        """
+        assert max_in_flight > 0, "At least one request has to be in flight"
+
+        tiles = give_tiles(min_coord, max_coord, max_voxels)
+        job = {"min": list(min_coord), "max": list(max_coord), "type": block_type, "max_voxels": max_voxels}
+        done = read_tile_cursor(cursor_path, job)
+
+        in_flight = deque()
+
+        def complete_oldest_tile():
+            # Tiles complete in submission order, hence done is always a contiguous prefix of tiles.
+            nonlocal done
+            in_flight.popleft().result()
+            done += 1
+            if cursor_path is not None:
+                write_tile_cursor(cursor_path, job, done)
+            if progress is not None:
+                progress(done, len(tiles))
+
+        for tile_min, tile_max in tiles[done:]:
+            if len(in_flight) == max_in_flight:
+                complete_oldest_tile()
+            in_flight.append(self._client.fillCube.future(FillCubeRequest(cube=give_cube(tile_min, tile_max),
+                                                                          type=block_type)))
+        while in_flight:
+            complete_oldest_tile()
+
+        if cursor_path is not None and os.path.exists(cursor_path):
+            os.remove(cursor_path)
+
+    def read_cube_tiles(self, min_coord: (int, int, int), max_coord: (int, int, int),
+                        max_voxels=READ_CUBE_MAX_VOXELS, max_in_flight=READ_CUBE_MAX_IN_FLIGHT):
+        """
+        Yields the readCube responses for the cube in tile order. Cubes larger than max_voxels are split into tiles
+        aligned to Minecraft chunks, of which at most max_in_flight are requested from the server at once, such that
+        reading a big cube takes about the time of its slowest tile instead of the sum of all tiles.
+        """
+        assert max_in_flight > 0, "At least one request has to be in flight"
+
+        tiles = deque(give_tiles(min_coord, max_coord, max_voxels, align=CHUNK_SIZE))
+        in_flight = deque()
+        while tiles or in_flight:
+            while tiles and len(in_flight) < max_in_flight:
+                in_flight.append(self._client.readCube.future(give_cube(*tiles.popleft())))
+            yield in_flight.popleft().result()
+
+    def read(self, min_coord: (int, int, int), max_coord: (int, int, int), block_types=None):
+        for response in self.read_cube_tiles(min_coord, max_coord):
+            yield decode_blocks(response.blocks, block_types)
+
+
+class NullBackend(WorldBackend):
+    """
+    A world that drops everything written to it and reads as AIR, such that a run costs only its own computation,
+    e.g., to profile the simulation without any server. Without physics, the shadow world is never reconciled.
+    """
+    physics = False
+
+    def spawn(self, coords, orientations, block_types):
+        pass
+
+    def fill(self, min_coord: (int, int, int), max_coord: (int, int, int), block_type: BlockType, progress=None,
+             **options):
+        if progress is not None:
+            progress(1, 1)
+
+    def read(self, min_coord: (int, int, int), max_coord: (int, int, int), block_types=None):
+        if block_types is None or AIR in block_types:
+            region_shape = [max_coord[i] - min_coord[i] + 1 for i in range(3)]
+            yield ((np.argwhere(np.ones(region_shape, dtype=bool)) + np.array(min_coord)).astype(np.int32),
+                   np.full(int(np.prod(region_shape)), AIR, dtype=np.uint8))
+
+
+class RecordingBackend(WorldBackend):
+    """
+    Passes all calls through to backend and records them in a JSON lines file at path, including everything read,
+    such that ReplayBackend can rerun the recorded run without the world it was recorded with.
+    """
+
+    def __init__(self, backend: WorldBackend, path):
+        self.backend = backend
+        self.physics = backend.physics
+        self._file = open(path, "w")
+        self._record({"op": "start", "physics": self.physics})
+
+    def _record(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+
+    def spawn(self, coords, orientations, block_types):
+        self._record({"op": "spawn", "blocks": len(coords)})
+        self.backend.spawn(coords, orientations, block_types)
+
+    def fill(self, min_coord: (int, int, int), max_coord: (int, int, int), block_type: BlockType, **options):
+        self._record({"op": "fill", "min": list(min_coord), "max": list(max_coord), "type": int(block_type)})
+        self.backend.fill(min_coord, max_coord, block_type, **options)
+
+    def read(self, min_coord: (int, int, int), max_coord: (int, int, int), block_types=None):
+        tiles = list(self.backend.read(min_coord, max_coord, block_types))
+        self._record({"op": "read", "min": list(min_coord), "max": list(max_coord),
+                      "tiles": [[coords.tolist(), types.tolist()] for coords, types in tiles]})
+        yield from tiles
+
+    def flush(self):
+        self.backend.flush()
+        self._record({"op": "flush"})
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ReplayBackend(WorldBackend):
+    """
+    Replays a recording of RecordingBackend: reads return what was read back then, writes go nowhere. A replay only
+    makes sense for the same run (same configuration and random seeds), hence every call is checked against the
+    recorded one and a diverging run fails right there.
+    """
+
+    def __init__(self, path):
+        self._file = open(path)
+        self.physics = self._give_entry("start")["physics"]
+
+    def _give_entry(self, op, **expected):
+        line = self._file.readline()
+        assert line, f"Replay exhausted, expected no further {op}"
+        entry = json.loads(line)
+        assert entry["op"] == op, f"Replay diverged: recorded {entry['op']}, called {op}"
+        for key, value in expected.items():
+            assert entry[key] == value, f"Replay diverged: recorded {op} with {key} {entry[key]}, called with {value}"
+        return entry
+
+    def spawn(self, coords, orientations, block_types):
+        self._give_entry("spawn", blocks=len(coords))
+
+    def fill(self, min_coord: (int, int, int), max_coord: (int, int, int), block_type: BlockType, progress=None,
+             **options):
+        self._give_entry("fill", min=list(min_coord), max=list(max_coord), type=int(block_type))
+        if progress is not None:
+            progress(1, 1)
+
+    def read(self, min_coord: (int, int, int), max_coord: (int, int, int), block_types=None):
+        entry = self._give_entry("read", min=list(min_coord), max=list(max_coord))
+        for coords, types in entry["tiles"]:
+            yield np.array(coords, dtype=np.int32).reshape((-1, 3)), np.array(types, dtype=np.uint8)
+
+    def flush(self):
+        self._give_entry("flush")
+
+    def close(self):
+        self._file.close()
+
+
+class BlockBuffer:
+    """
+    Blocks are buffered here and then sent to the world backend (by default the Minecraft server).
+    Everything sent is mirrored in shadow_world, such that the client knows the world without reading it back.
+    A flush may run in the background while the next buffer is filled (double buffering); at most one flush is in
+    flight and barrier() waits for it. Everything reading or filling the world waits for it implicitly.
+    Blocks of a failed flush stay buffered.
+    """
+    def __init__(self, address='localhost:5001', client=None, backend: WorldBackend = None):
+        """
+        Writes to backend, or else to the Minecraft server at address, unless another client with the interface of
+        minecraft_pb2_grpc.MinecraftServiceStub is given (e.g., fake_server.InProcessStub).
+        """
+        self._batches = list()  # buffered (coords, orientations, block types) arrays, in the order of adding
+        self._coords, self._orientations, self._types = list(), list(), list()  # single blocks not batched yet
+        self.shadow_world = ShadowWorld()
+        self._flush_executor = ThreadPoolExecutor(max_workers=1)
+        self._flush_future = None
+        self.backend = GrpcBackend(address, client) if backend is None else backend
 
     def add_block(self, coord: (int, int, int), orientation: int, block_type: int):
-        assert block_type in BLOCK_TYPES, f"Unknown block type: {block_type}"
-        assert orientation in BLOCK_ORIENTATIONS, f"Unknown orientation: {orientation}"
+        assert block_type in BLOCK_TYPES_SET, f"Unknown block type: {block_type}"
+        assert orientation in BLOCK_ORIENTATIONS_SET, f"Unknown orientation: {orientation}"
+
+        self._coords.append(coord)
+        self._orientations.append(orientation)
+        self._types.append(block_type)
 
-        self._blocks.append(Block(
-            position=Point(x=coord[0], y=coord[1], z=coord[2]),
-            type=block_type,
-            orientation=orientation))
+    def add_blocks(self, coords, orientations, block_types):
+        """
+        Buffers many blocks at once: coords of shape (n, 3) and orientations and block_types of shape (n,) (or scalars
+        shared by all blocks), validated in a single vectorized pass.
+        """
+        coords = np.asarray(coords, dtype=np.int32).reshape((-1, 3))
+        orientations = np.broadcast_to(np.asarray(orientations, dtype=np.uint8), (len(coords),))
+        block_types = np.broadcast_to(np.asarray(block_types, dtype=np.uint8), (len(coords),))
+        assert give_type_mask(block_types, BLOCK_TYPES).all(), "Unknown block type"
+        assert give_type_mask(orientations, BLOCK_ORIENTATIONS).all(), "Unknown orientation"
 
-    def send_to_server(self):
-        response = self._client.spawnBlocks(Blocks(blocks=self._blocks))
-        self._blocks = []
-        return response
+        self._batch_single_blocks()
+        self._batches.append((coords, orientations, block_types))
 
-    def fill_cube(self, start_coord: (int, int, int), end_coord: (int, int, int), block_type: BlockType):
+    def _batch_single_blocks(self):
+        if self._coords:
+            self._batches.append((np.array(self._coords, dtype=np.int32).reshape((-1, 3)),
+                                  np.array(self._orientations, dtype=np.uint8),
+                                  np.array(self._types, dtype=np.uint8)))
+            self._coords, self._orientations, self._types = list(), list(), list()
+
+    def _give_buffered_blocks(self):
+        """
+        Returns all buffered blocks as coords, orientations and block types arrays, in the order they were added.
+        """
+        self._batch_single_blocks()
+        if not self._batches:
+            return np.zeros((0, 3), dtype=np.int32), np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint8)
+        return tuple(np.concatenate([batch[i] for batch in self._batches]) for i in range(3))
+
+    def coalesce(self):
+        """
+        Collapses the buffer to the writes that actually change the world:
+        (1) only the last write to every coordinate is kept,
+        (2) writes of the block (type and orientation) the shadow world already knows there are dropped.
+        Returns the remaining coords, orientations and block types.
+        """
+        coords, orientations, block_types = self._give_buffered_blocks()
+        last = give_last_writes(coords)
+        coords, orientations, block_types = coords[last], orientations[last], block_types[last]
+        known_types, known_orientations = self.shadow_world.give_blocks_at(coords)
+        changing = (known_types != block_types) | (known_orientations != orientations)
+        return coords[changing], orientations[changing], block_types[changing]
+
+    def send_to_server(self, wait=True):
+        """
+        Sends the coalesced buffer to the backend and flushes it (see GrpcBackend.spawn for how it reaches the server).
+        Without wait, the flush runs in the background and the buffer is immediately free for the next blocks.
+        Returns the future of the flush.
+        """
+        self.barrier()
+        coords, orientations, block_types = self.coalesce()
+        self._batches = list()
+        flush_future = self._flush_executor.submit(self._send_blocks, coords, orientations, block_types)
+        self._flush_future = flush_future
+        if wait:
+            self.barrier()
+        return flush_future
+
+    def barrier(self):
+        """
+        Waits until the flush in flight (if any) is written and mirrors it in the shadow world.
+        If the flush failed, its unsent blocks are put back in front of the buffer and the FlushError is raised.
+        """
+        if self._flush_future is not None:
+            flush_future, self._flush_future = self._flush_future, None
+            try:
+                self.shadow_world.set_blocks(*flush_future.result())
+            except FlushError as e:
+                self.shadow_world.set_blocks(*e.sent)
+                self._batches.insert(0, e.unsent)
+                raise
+
+    def _send_blocks(self, coords, orientations, block_types):
+        self.backend.spawn(coords, orientations, block_types)
+        self.backend.flush()
+        return coords, orientations, block_types
+
+    def fill_cube(self, start_coord: (int, int, int), end_coord: (int, int, int), block_type: BlockType, **options):
+        """
+        Fills the cube with blocks of block_type. The options go to the fill of the backend (e.g., tiling, a cursor
+        file and a progress callback for the Minecraft server, see GrpcBackend.fill).
+        """
         assert block_type in BLOCK_TYPES, "Unknown block type"
 
-        min_x, max_x = (start_coord[0], end_coord[0]) if start_coord[0] < end_coord[0] else (end_coord[0],
-                                                                                             start_coord[0])
-        min_y, max_y = (start_coord[1], end_coord[1]) if start_coord[1] < end_coord[1] else (end_coord[1],
-                                                                                             start_coord[1])
-        min_z, max_z = (start_coord[2], end_coord[2]) if start_coord[2] < end_coord[2] else (end_coord[2],
-                                                                                             start_coord[2])
-        self._client.fillCube(FillCubeRequest(
-            cube=Cube(min=Point(x=min_x, y=min_y, z=min_z),
-                      max=Point(x=max_x, y=max_y, z=max_z)),
-            type=block_type
-        ))
+        self.barrier()
+        min_coord, max_coord = give_min_max(start_coord, end_coord)
+        self.backend.fill(min_coord, max_coord, block_type, **options)
+        self.shadow_world.fill(min_coord, max_coord, block_type)
+
+    def get_cube_arrays(self, start_coord: (int, int, int), end_coord: (int, int, int), block_types=None):
+        """
+        Returns the blocks in the cube (only those of block_types, if given) decoded into int32 coordinates of shape
+        (n, 3) and uint8 block types.
+        """
+        self.barrier()
+        tiles = list(self.backend.read(*give_min_max(start_coord, end_coord), block_types))
+        if not tiles:
+            return np.zeros((0, 3), dtype=np.int32), np.zeros(0, dtype=np.uint8)
+        return np.concatenate([coords for coords, _ in tiles]), np.concatenate([types for _, types in tiles])
 
     def get_cube_info(self, start_coord: (int, int, int), end_coord: (int, int, int)):
-        min_x, max_x = (start_coord[0], end_coord[0]) if start_coord[0] < end_coord[0] else (end_coord[0],
-                                                                                             start_coord[0])
-        min_y, max_y = (start_coord[1], end_coord[1]) if start_coord[1] < end_coord[1] else (end_coord[1],
-                                                                                             start_coord[1])
-        min_z, max_z = (start_coord[2], end_coord[2]) if start_coord[2] < end_coord[2] else (end_coord[2],
-                                                                                             start_coord[2])
-        response = self._client.readCube(Cube(min=Point(x=min_x, y=min_y, z=min_z),
-                                              max=Point(x=max_x, y=max_y, z=max_z)))
-        return response.blocks
+        """
+        Returns a list of all blocks in the cube as Block messages, merged across the tiles it is read in.
+        """
+        self.barrier()
+        return [Block(position=Point(x=x, y=y, z=z), type=block_type)
+                for coords, types in self.backend.read(*give_min_max(start_coord, end_coord))
+                for (x, y, z), block_type in zip(coords.tolist(), types.tolist())]
+
+    def settle_sand(self, start_coord: (int, int, int), end_coord: (int, int, int)):
+        """
+        Lets the SAND within the cube fall in the shadow world like the world lets it fall (see
+        ShadowWorld.settle_sand). Backends without physics keep SAND where it was put, and so does the shadow world.
+        """
+        if not self.backend.physics:
+            return
+        self.shadow_world.settle_sand(*give_min_max(start_coord, end_coord))
+
+    def reconcile_physics(self, start_coord: (int, int, int), end_coord: (int, int, int)):
+        """
+        Reconciles the parts of the cube in which physics may have moved blocks (see ShadowWorld.give_physics_boxes).
+        """
+        if not self.backend.physics:
+            return
+        for box_min, box_max in self.shadow_world.give_physics_boxes(*give_min_max(start_coord, end_coord)):
+            self.reconcile(box_min, box_max)
+
+    def reconcile(self, start_coord: (int, int, int), end_coord: (int, int, int)):
+        """
+        Reads the cube back from the world and overwrites the shadow world there with what it reports. Backends
+        without physics keep blocks where they were put, so there is nothing to read.
+        """
+        if not self.backend.physics:
+            return
+        min_coord, max_coord = give_min_max(start_coord, end_coord)
+        self.shadow_world.reconcile(min_coord, max_coord,
+                                    *self.get_cube_arrays(min_coord, max_coord, block_types=NON_AIR_BLOCK_TYPES))